@@ -0,0 +1,379 @@
+import argparse, gc, json, os.path, sys, tempfile, time, tracemalloc
+
+try:
+    from . import memrise, memrise_async, memrise_markdown, oembed, fakeserver
+except ImportError:
+    import memrise, memrise_async, memrise_markdown, oembed, fakeserver
+
+class Timer(object):
+    def __init__(self):
+        self.start = None
+        self.elapsed = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.perf_counter() - self.start
+
+class LatencyObserver(object):
+    def __init__(self):
+        self.levelTimes = []
+        self.last = time.perf_counter()
+
+    def levelLoaded(self, levelIndex, level=None):
+        now = time.perf_counter()
+        self.levelTimes.append(now - self.last)
+        self.last = now
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+def createService(server, downloadDirectory, useAsync=False, maxConnectionsPerHost=8):
+    service = fakeserver.redirectService(memrise.Service(downloadDirectory, rateLimiter=memrise.RateLimiter(backoff=0.1)), server)
+    if not useAsync:
+        return service
+    transport = fakeserver.RedirectTransport(server.url) if memrise_async.httpx else None
+    return memrise_async.SyncFacade(memrise_async.AsyncService(service, maxConnectionsPerHost=maxConnectionsPerHost, transport=transport))
+
+def benchmarkLoad(server, courseId, maxConcurrentLevels=1, maxConcurrentDownloads=1, downloadMedia=True, useAsync=False):
+    with tempfile.TemporaryDirectory() as downloadDirectory:
+        service = createService(server, downloadDirectory, useAsync, max(maxConcurrentLevels, maxConcurrentDownloads))
+        observer = LatencyObserver()
+        url = "https://community-courses.memrise.com/community/course/{:d}/synthetic/".format(courseId)
+
+        with Timer() as loadTimer:
+            course = service.loadCourse(url, observer, maxConcurrentLevels=maxConcurrentLevels)
+
+        mediaCount = 0
+        with Timer() as mediaTimer:
+            if downloadMedia:
+                downloader = memrise.MediaDownloader(service.downloadMedia, maxConcurrentDownloads, getattr(service, 'submitDownloadMedia', None))
+                try:
+                    for media in course.getMediaFiles():
+                        downloader.enqueue(media)
+                finally:
+                    downloader.join()
+                mediaCount = len(downloader)
+
+        stats = service.rateLimiter.stats()
+        if useAsync:
+            service.close()
+
+    return {
+        'levels': len(course),
+        'learnables': course.len_learnables(),
+        'media': mediaCount,
+        'load': loadTimer.elapsed,
+        'download': mediaTimer.elapsed,
+        'level_p50': percentile(observer.levelTimes, 0.5),
+        'level_p95': percentile(observer.levelTimes, 0.95),
+        'requests': stats,
+    }
+
+def benchmarkMemory(server, courseId):
+    # memory kept by a loaded course, measured with tracemalloc
+    service = createService(server, None)
+    url = "https://community-courses.memrise.com/community/course/{:d}/synthetic/".format(courseId)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        course = service.loadCourse(url)
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'learnables': course.len_learnables(), 'current': current, 'peak': peak}
+
+def formatMemory(levelCount, result):
+    return "{:>6d} levels {:>7d} learnables | retained {:8.1f} MiB ({:6.0f} bytes/learnable) | peak {:8.1f} MiB".format(
+        levelCount, result['learnables'], result['current'] / 2**20,
+        result['current'] / result['learnables'] if result['learnables'] else 0.0, result['peak'] / 2**20)
+
+def benchmarkParse(levelCount, learnablesPerLevel=20, mediaPerLearnable=1):
+    # the level parser against plain json.loads, both followed by CourseLoader.loadLevel
+    texts = [json.dumps(fakeserver.levelData(1, i, learnablesPerLevel, mediaPerLearnable)).encode('utf-8') for i in range(1, levelCount + 1)]
+    service = memrise.Service()
+    results = {}
+    for name, parse in [('json', json.loads), ('parser', service.parseLevelData)]:
+        course = memrise.Course(1)
+        loader = memrise.CourseLoader(service)
+        parseTime = loadTime = 0.0
+        for levelIndex, text in enumerate(texts, 1):
+            with Timer() as parseTimer:
+                levelData = parse(text)
+            with Timer() as loadTimer:
+                loader.loadLevel(course, levelIndex, levelData)
+            parseTime += parseTimer.elapsed
+            loadTime += loadTimer.elapsed
+        del course, levelData
+        gc.collect()
+        tracemalloc.start()
+        try:
+            levelData = parse(texts[-1])
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        del levelData
+        results[name] = {'parse': parseTime, 'load': loadTime, 'peak': peak, 'current': current}
+    return results
+
+def formatParse(levelCount, learnablesPerLevel, results):
+    return "\n".join("{:>6d} levels {:>5d} learnables/level | {:<6s} parse {:7.3f}s load {:7.3f}s | one level kept {:6.1f} MiB peak {:6.1f} MiB".format(
+        levelCount, learnablesPerLevel, name, result['parse'], result['load'], result['current'] / 2**20, result['peak'] / 2**20)
+        for name, result in results.items())
+
+def generatedCoursePages(levelCounts, scriptSize=200*1024):
+    # course pages carry large inline scripts, which the extractor has to skip
+    script = '<script>window.__DATA__ = {};</script>\n'.format(json.dumps({'padding': 'x' * scriptSize}))
+    for courseId, levelCount in enumerate(levelCounts, 1):
+        yield "course {:d} ({:d} levels)".format(courseId, levelCount), fakeserver.coursePage(courseId, levelCount).replace('</head>', script + '</head>')
+
+def benchmarkHtml(pages, repeat=5):
+    # the targeted course page extractor against the BeautifulSoup parse
+    results = []
+    for name, html in pages:
+        times = {}
+        for method in ['extractCourseData', 'parseCourseDataWithSoup']:
+            parse = getattr(memrise.Service, method)
+            with Timer() as timer:
+                for _ in range(repeat):
+                    data = parse(html)
+            times[method] = (timer.elapsed / repeat, data)
+        results.append((name, len(html), times))
+    return results
+
+def formatHtml(result):
+    name, size, times = result
+    fast, fastData = times['extractCourseData']
+    soup, soupData = times['parseCourseDataWithSoup']
+    return "{:<30s} {:>8d} bytes | extractor {:8.2f}ms{} | soup {:8.2f}ms | {:6.1f}x".format(
+        name[-30:], size, fast * 1000, "" if fastData == soupData else " (falls back)" if fastData is None else " (differs)",
+        soup * 1000, soup / fast if fast else 0.0)
+
+def markdownFieldValues(levelCount, learnablesPerLevel=20):
+    # text column values as rich-text courses have them: short plain words, some markup and
+    # images, with definitions and notes that repeat across levels
+    notes = ["", "", "**noun**", "*informal*", "see also: `word{:d}`", "img: https://static.memrise.com/image/{:d}.png",
+             "![](https://static.memrise.com/image/{:d}.jpg) _plural_", "embed: https://www.youtube.com/watch?v={:d}"]
+    for position in range(1, levelCount * learnablesPerLevel + 1):
+        yield "word{:d}".format(position)
+        yield "meaning of word{:d}".format(position % 500)
+        yield notes[position % len(notes)].format(position % 200)
+
+def benchmarkMarkdown(levelCount, learnablesPerLevel=20):
+    # a Markdown instance per value against the reusable converter, with and without its memo
+    values = list(markdownFieldValues(levelCount, learnablesPerLevel))
+    methods = [
+        ('per value', lambda texts: [memrise_markdown.Markdown([])(text) for text in texts]),
+        ('reused', memrise_markdown.Converter(cacheSize=0).convert_many),
+        ('cached', memrise_markdown.Converter().convert_many),
+    ]
+    results = {}
+    for name, convertMany in methods:
+        with Timer() as timer:
+            output = convertMany(values)
+        results[name] = (timer.elapsed, output)
+    return len(values), results
+
+def longDescription(lines):
+    # a course description written as one long paragraph with some markup
+    sentences = ["Learn the **{:d} most common** words of the language.", "Audio by _native speakers_, see https://example.com/{:d}.",
+                 "Level {:d} covers `verbs` and ~~nouns~~ adjectives.", "img: https://static.memrise.com/image/{:d}.png"]
+    return "\n".join(sentences[i % len(sentences)].format(i) for i in range(lines))
+
+def benchmarkDescriptions(lineCounts):
+    # mistune slicing off every match, matching every rule in place and matching all inline rules at once
+    mistune = memrise_markdown.mistune
+    settings = [(mistune.BlockLexer, 'scan_positions'), (mistune.InlineLexer, 'scan_positions'), (memrise_markdown.MemriseInlineLexer, 'combine_rules')]
+    modes = [('slicing', (False, False, False)), ('positions', (True, True, False)), ('combined', (True, True, True))]
+    results = []
+    for lines in lineCounts:
+        text = longDescription(lines)
+        times = {}
+        for name, values in modes:
+            saved = [getattr(cls, attr) for cls, attr in settings]
+            for (cls, attr), value in zip(settings, values):
+                setattr(cls, attr, value)
+            try:
+                with Timer() as timer:
+                    output = memrise_markdown.Converter(cacheSize=0).convert(text)
+            finally:
+                for (cls, attr), value in zip(settings, saved):
+                    setattr(cls, attr, value)
+            times[name] = (timer.elapsed, output)
+        results.append((len(text), times))
+    return results
+
+def formatDescription(result):
+    size, times = result
+    slicing, reference = times['slicing']
+    return "description {:>9d} chars | {}".format(size, " | ".join("{} {:7.3f}s ({:4.1f}x){}".format(
+        name, elapsed, slicing / elapsed if elapsed else 0.0, "" if output == reference else " (differs)")
+        for name, (elapsed, output) in times.items()))
+
+def groupingCourse(count, learnablesPerLevel=20, duplicateEvery=143):
+    # a loaded course of count learnables, every duplicateEvery-th one repeating the content of an earlier one
+    course = memrise.Course(1)
+    loader = memrise.CourseLoader(memrise.Service())
+    levelCount = (count + learnablesPerLevel - 1) // learnablesPerLevel
+    for levelIndex in range(1, levelCount + 1):
+        levelData = fakeserver.levelData(1, levelIndex, learnablesPerLevel)
+        for position, learnable in enumerate(levelData['learnables'], (levelIndex - 1) * learnablesPerLevel + 1):
+            if position % duplicateEvery == 0:
+                duplicate = fakeserver.learnableData(1, levelIndex, position // duplicateEvery)
+                duplicate['id'] = learnable['id']
+                learnable.update(duplicate)
+        level = loader.loadLevel(course, levelIndex, levelData)
+        if level:
+            course.addLevel(level)
+    return course
+
+def groupsOf(groups):
+    return sorted(sorted(learnable.id for learnable in learnables) for learnables in groups.values())
+
+def benchmarkGrouping(count, learnablesPerLevel=20):
+    # grouping similar learnables by checksum() against the fingerprints stored while loading
+    course = groupingCourse(count, learnablesPerLevel)
+    learnables = list(course.all_learnables())
+    results = {}
+    with Timer() as timer:
+        groups = {}
+        for learnable in learnables:
+            groups.setdefault(learnable.checksum(), []).append(learnable)
+    results['checksum'] = (timer.elapsed, groupsOf(groups))
+    with Timer() as timer:
+        groups = course.similar_learnables()
+    results['fingerprint'] = (timer.elapsed, groupsOf(groups))
+    for learnable in learnables:
+        learnable.fingerprint = None
+    with Timer() as timer:
+        for learnable in learnables:
+            learnable.updateFingerprint()
+    results['building fingerprints'] = (timer.elapsed, None)
+    return len(learnables), results
+
+def formatGrouping(result):
+    count, results = result
+    reference = results['checksum'][1]
+    return "\n".join("{:>7d} learnables | {:<21s} {:7.3f}s{}".format(
+        count, name, elapsed, "" if groups is None else " | {:>6d} duplicate groups{}".format(
+            sum(1 for group in groups if len(group) > 1), "" if groups == reference else " (differs)"))
+        for name, (elapsed, groups) in results.items())
+
+def formatMarkdown(levelCount, result):
+    count, results = result
+    reference = results['per value'][1]
+    return "\n".join("{:>6d} levels {:>7d} values | {:<9s} {:7.3f}s ({:9.1f} values/s){}".format(
+        levelCount, count, name, elapsed, count / elapsed if elapsed else 0.0, "" if output == reference else " (differs)")
+        for name, (elapsed, output) in results.items())
+
+def benchmarkEmbeds(server, count, maxWorkers=8):
+    # resolving embed links one by one, concurrently and again from the cache
+    urls = ["https://www.youtube.com/watch?v={:d}".format(i) if i % 4 else "https://example.com/clip/{:d}".format(i) for i in range(count)]
+    endpoint = server.url + "/embed"
+    results = {}
+    with tempfile.TemporaryDirectory() as cacheDirectory:
+        cache = oembed.EmbedCache(os.path.join(cacheDirectory, 'embeds'))
+        try:
+            for name, resolver in [('serial', oembed.EmbedResolver(endpoint=endpoint, maxWorkers=1)),
+                                   ('parallel', oembed.EmbedResolver(cache, endpoint=endpoint, maxWorkers=maxWorkers)),
+                                   ('cached', oembed.EmbedResolver(cache, endpoint=endpoint, maxWorkers=maxWorkers))]:
+                before = server.counters.get('embeds', 0)
+                with Timer() as timer:
+                    resolved = resolver.resolveMany(urls)
+                results[name] = (timer.elapsed, server.counters.get('embeds', 0) - before, sum(1 for html in resolved.values() if html))
+        finally:
+            cache.close()
+    return results
+
+def formatEmbeds(count, results):
+    return "\n".join("{:>6d} embeds | {:<8s} {:7.3f}s | requests {:>6d} | resolved {:>6d}".format(count, name, elapsed, requests, resolved)
+                     for name, (elapsed, requests, resolved) in results.items())
+
+def formatResult(levelCount, result):
+    total = result['load'] + result['download']
+    return ("{:>6d} levels {:>7d} learnables {:>7d} media | load {:7.2f}s ({:8.1f} levels/s, {:9.1f} learnables/s) "
+            "p50 {:6.1f}ms p95 {:6.1f}ms | media {:7.2f}s ({:8.1f} files/s) | total {:7.2f}s").format(
+        levelCount, result['learnables'], result['media'],
+        result['load'], result['levels'] / result['load'] if result['load'] else 0.0,
+        result['learnables'] / result['load'] if result['load'] else 0.0,
+        result['level_p50'] * 1000, result['level_p95'] * 1000,
+        result['download'], result['media'] / result['download'] if result['download'] else 0.0,
+        total) + "\n       requests {:d} retries {:d} throttled {:d} failed {:d} | latency avg {:.1f}ms max {:.1f}ms | rate {}".format(
+        result['requests'].get('requests', 0), result['requests'].get('retries', 0), result['requests'].get('throttled', 0),
+        result['requests'].get('failed', 0), result['requests']['latency_avg'] * 1000, result['requests']['latency_max'] * 1000,
+        "unlimited" if result['requests']['rate'] is None else "{:.1f}/s".format(result['requests']['rate']))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark course loading against a local fake Memrise server.")
+    parser.add_argument('--levels', type=int, nargs='+', default=[10, 100, 1000], help="level counts of the synthetic courses (default: 10 100 1000)")
+    parser.add_argument('--learnables', type=int, default=20, help="learnables per level (default: 20)")
+    parser.add_argument('--media-per-learnable', type=int, default=1, help="audio files per learnable, plus one image (default: 1)")
+    parser.add_argument('--media-size', type=int, default=16*1024, help="size of every media file in bytes (default: 16384)")
+    parser.add_argument('--latency', type=float, default=0.0, help="server latency per request in seconds (default: 0)")
+    parser.add_argument('--max-rate', type=float, default=None, help="requests per second the server accepts before answering 429 (default: unlimited)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests answered with an error (default: 0)")
+    parser.add_argument('--concurrent-levels', type=int, default=1, help="concurrent level requests (default: 1)")
+    parser.add_argument('--concurrent-downloads', type=int, default=1, help="concurrent media downloads (default: 1)")
+    parser.add_argument('--async', dest='useAsync', action='store_true', help="use memrise_async.AsyncService, the concurrency options limit the connections per host")
+    parser.add_argument('--no-media', action='store_true', help="skip the media download")
+    parser.add_argument('--memory', action='store_true', help="measure the memory of the loaded courses instead of the load time")
+    parser.add_argument('--parse', action='store_true', help="compare the level parser against json.loads, without a server")
+    parser.add_argument('--html', metavar='FILE', nargs='*', help="compare the course page extractor against BeautifulSoup on saved course pages, or on generated pages if none are given")
+    parser.add_argument('--markdown', action='store_true', help="compare the reusable markdown converter against a Markdown instance per field value, without a server")
+    parser.add_argument('--grouping', type=int, metavar='COUNT', nargs='?', const=50000, help="group the similar learnables of a course of COUNT learnables (default: 50000) by checksum() and by their stored fingerprints, without a server")
+    parser.add_argument('--embeds', type=int, metavar='COUNT', help="resolve COUNT embed links against the server's oEmbed endpoint, serially, concurrently and from the cache")
+    parser.add_argument('--seed', type=int, default=0, help="random seed for error injection (default: 0)")
+    args = parser.parse_args(argv)
+
+    if args.html is not None:
+        if args.html:
+            pages = []
+            for filename in args.html:
+                with open(filename, encoding='utf-8') as htmlFile:
+                    pages.append((filename, htmlFile.read()))
+        else:
+            pages = generatedCoursePages(args.levels)
+        for result in benchmarkHtml(pages):
+            print(formatHtml(result))
+        return 0
+
+    if args.markdown:
+        for levelCount in args.levels:
+            print(formatMarkdown(levelCount, benchmarkMarkdown(levelCount, args.learnables)))
+        for result in benchmarkDescriptions([100, 1000, 10000]):
+            print(formatDescription(result))
+        return 0
+
+    if args.grouping:
+        print(formatGrouping(benchmarkGrouping(args.grouping, args.learnables)))
+        return 0
+
+    if args.parse:
+        for levelCount in args.levels:
+            print(formatParse(levelCount, args.learnables, benchmarkParse(levelCount, args.learnables, args.media_per_learnable)))
+        return 0
+
+    levels = {courseId: levelCount for courseId, levelCount in enumerate(args.levels, 1)}
+    with fakeserver.FakeMemriseServer(levels=levels, learnablesPerLevel=args.learnables, mediaPerLearnable=args.media_per_learnable,
+                                      mediaSize=args.media_size, latency=args.latency, errorRate=args.error_rate, maxRate=args.max_rate, seed=args.seed) as server:
+        for courseId, levelCount in levels.items():
+            if args.embeds:
+                print(formatEmbeds(args.embeds, benchmarkEmbeds(server, args.embeds, args.concurrent_downloads)))
+                break
+            if args.memory:
+                print(formatMemory(levelCount, benchmarkMemory(server, courseId)))
+                continue
+            result = benchmarkLoad(server, courseId, args.concurrent_levels, args.concurrent_downloads, not args.no_media, args.useAsync)
+            print(formatResult(levelCount, result))
+        print("server: {}".format(", ".join("{} {:d}".format(k, v) for k, v in sorted(server.counters.items()))))
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,158 @@
+import argparse, concurrent.futures, http.cookiejar, json, os.path, sys
+
+try:
+    from . import memrise, memrise_async
+except ImportError:
+    import memrise, memrise_async
+
+def dumpColumnData(column, data):
+    if isinstance(data, memrise.TextColumnData):
+        return {
+            'type': column.type,
+            'values': data.values,
+            'alternatives': data.alternatives,
+            'hiddenAlternatives': data.hiddenAlternatives,
+            'typingCorrects': data.typingCorrects,
+        }
+    return {
+        'type': column.type,
+        'files': [{'remoteUrl': f.remoteUrl, 'localUrl': f.localUrl} for f in data.getFiles()],
+    }
+
+def dumpDate(date):
+    return date.isoformat() if date else None
+
+def dumpProgress(progress):
+    return {
+        'ignored': progress.ignored,
+        'last_date': dumpDate(progress.last_date),
+        'created_date': dumpDate(progress.created_date),
+        'next_date': dumpDate(progress.next_date),
+        'interval': progress.interval,
+        'growth_level': progress.growth_level,
+        'attempts': progress.attempts,
+        'correct': progress.correct,
+        'incorrect': progress.incorrect,
+        'total_streak': progress.total_streak,
+        'current_streak': progress.current_streak,
+        'position': progress.position,
+    }
+
+def dumpLearnable(learnable):
+    course = learnable.course
+    columns = {}
+    for column in course.getColumns():
+        if column.name in learnable.columnData:
+            columns[column.name] = dumpColumnData(column, learnable.columnData[column.name])
+    return {
+        'id': learnable.id,
+        'identifiers': sorted(learnable.identifiers),
+        'level': learnable.level.index,
+        'levelTitle': learnable.level.title,
+        'direction': {'front': learnable.direction.front, 'back': learnable.direction.back} if learnable.direction else None,
+        'columns': columns,
+        'attributes': {name: data.values for name, data in learnable.attributeData.items()},
+        'progress': dumpProgress(learnable.progress),
+    }
+
+def exportCourse(url, outputDirectory, cookiejar=None, downloadMedia=False, maxConcurrentLevels=4, maxConcurrentDownloads=8, useAsync=False):
+    courseId = memrise.Service.getCourseIdFromUrl(url)
+    courseDirectory = os.path.join(outputDirectory, str(courseId))
+    mediaDirectory = os.path.join(courseDirectory, 'media')
+    os.makedirs(mediaDirectory if downloadMedia else courseDirectory, exist_ok=True)
+
+    service = memrise.Service(mediaDirectory if downloadMedia else None, cookiejar)
+    submitDownload = None
+    if useAsync:
+        service = memrise_async.SyncFacade(memrise_async.AsyncService(service, maxConnectionsPerHost=max(maxConcurrentLevels, maxConcurrentDownloads)))
+        submitDownload = lambda u: service.submitDownloadMedia(u, skipExisting=True)
+
+    try:
+        course = service.loadCourse(url, maxConcurrentLevels=maxConcurrentLevels)
+
+        if downloadMedia:
+            downloader = memrise.MediaDownloader(lambda u: service.downloadMedia(u, skipExisting=True), maxConcurrentDownloads, submitDownload)
+            try:
+                for media in course.getMediaFiles():
+                    if media.remoteUrl and not media.isDownloaded():
+                        downloader.enqueue(media)
+            finally:
+                downloader.join()
+    finally:
+        if useAsync:
+            service.close()
+
+    with open(os.path.join(courseDirectory, 'course.json'), 'w', encoding='utf-8') as courseFile:
+        json.dump({
+            'id': course.id,
+            'url': url,
+            'title': course.title,
+            'description': course.description,
+            'levels': [{'index': level.index, 'title': level.title, 'learnables': len(level)} for level in course],
+            'columns': [{'name': c.name, 'type': c.type, 'side': c.side} for c in course.getColumns()],
+            'attributes': [{'name': a.name, 'type': a.type} for a in course.getAttributes()],
+        }, courseFile, ensure_ascii=False, indent=2)
+
+    with open(os.path.join(courseDirectory, 'learnables.jsonl'), 'w', encoding='utf-8') as learnablesFile:
+        for learnable in course.all_learnables():
+            learnablesFile.write(json.dumps(dumpLearnable(learnable), ensure_ascii=False))
+            learnablesFile.write('\n')
+
+    manifest = {}
+    for media in course.getMediaFiles():
+        if media.remoteUrl:
+            manifest.setdefault(media.remoteUrl, media.localUrl if downloadMedia else None)
+    with open(os.path.join(courseDirectory, 'media.json'), 'w', encoding='utf-8') as manifestFile:
+        json.dump([{'remoteUrl': k, 'localUrl': v} for k, v in manifest.items()], manifestFile, ensure_ascii=False, indent=2)
+
+    return course
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export Memrise community courses without Anki.")
+    parser.add_argument('urls', metavar='URL', nargs='+', help="home URL of a course")
+    parser.add_argument('-o', '--output', default='.', help="output directory, one sub-directory per course (default: current directory)")
+    parser.add_argument('-c', '--cookies', help="Mozilla cookie file to load and save the login session")
+    parser.add_argument('-u', '--username', help="log in with this username if the session is not logged in")
+    parser.add_argument('-p', '--password', help="password for --username")
+    parser.add_argument('-m', '--media', action='store_true', help="download media files")
+    parser.add_argument('-j', '--jobs', type=int, default=2, help="number of courses exported in parallel (default: 2)")
+    parser.add_argument('--levels', type=int, default=4, help="concurrent level requests per course (default: 4)")
+    parser.add_argument('--downloads', type=int, default=8, help="concurrent media downloads per course (default: 8)")
+    parser.add_argument('--async', dest='useAsync', action='store_true', help="load on an asyncio event loop (uses httpx if installed)")
+    args = parser.parse_args(argv)
+
+    for url in args.urls:
+        if not memrise.Service.checkCourseUrl(url):
+            parser.error("invalid course URL: {}".format(url))
+
+    if args.cookies:
+        cookiejar = http.cookiejar.MozillaCookieJar(args.cookies)
+        if os.path.isfile(args.cookies):
+            cookiejar.load()
+    else:
+        cookiejar = http.cookiejar.CookieJar()
+
+    if args.username:
+        service = memrise.Service(cookiejar=cookiejar)
+        if not service.isLoggedIn() and not service.login(args.username, args.password or ''):
+            print("Couldn't log in. Please check your credentials.", file=sys.stderr)
+            return 1
+        if args.cookies:
+            cookiejar.save()
+
+    failed = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+        futures = {executor.submit(exportCourse, url, args.output, cookiejar, args.media, args.levels, args.downloads, args.useAsync): url for url in args.urls}
+        for future in concurrent.futures.as_completed(futures):
+            url = futures[future]
+            try:
+                course = future.result()
+                print("{}: {} ({} levels, {} learnables)".format(url, course.title, len(course), course.len_learnables()))
+            except Exception as e:
+                failed += 1
+                print("{}: {}".format(url, e), file=sys.stderr)
+
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
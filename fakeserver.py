@@ -0,0 +1,259 @@
+import collections, http.server, json, random, re, threading, time, urllib.parse
+import requests.adapters
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+def learnableData(courseId, levelIndex, position, mediaPerLearnable=1):
+    learnableId = courseId * 1000000 + position
+    word = "word{:d}".format(position)
+    return {
+        'id': learnableId,
+        'screens': {
+            '1': {
+                'template': 'presentation',
+                'item': {'label': 'Word', 'kind': 'text', 'value': word, 'alternatives': ['alt' + word, '_hidden' + word], 'direction': 'source'},
+                'definition': {'label': 'Definition', 'kind': 'text', 'value': 'meaning of {}, {}'.format(word, position), 'alternatives': [], 'direction': 'target'},
+                'audio': {'label': 'Audio', 'kind': 'audio', 'value': [{'normal': '/static/audio/{:d}/{:d}-{:d}.mp3'.format(courseId, position, i)} for i in range(mediaPerLearnable)], 'direction': 'target'},
+                'video': None,
+                'visible_info': [{'label': 'Image', 'kind': 'image', 'value': [{'normal': '/static/image/{:d}/{:d}.jpg'.format(courseId, position)}], 'direction': 'target'}] if mediaPerLearnable else [],
+                'hidden_info': [],
+                'attributes': [{'label': 'Part of Speech', 'value': 'noun'}],
+            },
+            '2': {'template': 'typing', 'answer': {'label': 'Word'}, 'correct': [word, word.upper(), '']},
+            '3': {'template': 'multiple_choice', 'choices': ['word{:d}'.format(position + i) for i in range(8)]},
+            '4': {'template': 'reversed_multiple_choice', 'choices': ['word{:d}'.format(position + i) for i in range(8)]},
+        },
+    }
+
+def progressData(learnableId, position):
+    if position % 3 == 0:
+        return None
+    return {
+        'learnable_id': str(learnableId),
+        'ignored': position % 11 == 0,
+        'last_date': '2023-05-{:02d}T10:00:00Z'.format(position % 28 + 1),
+        'created_date': '2023-01-{:02d}T10:00:00Z'.format(position % 28 + 1),
+        'next_date': '2023-06-{:02d}T10:00:00Z'.format(position % 28 + 1),
+        'interval': position % 30 + 0.5,
+        'growth_level': position % 6,
+        'attempts': position % 9 + 1,
+        'correct': position % 5,
+        'total_streak': position % 4,
+        'current_streak': position % 2,
+    }
+
+def levelData(courseId, levelIndex, learnablesPerLevel=20, mediaPerLearnable=1):
+    positions = range((levelIndex - 1) * learnablesPerLevel + 1, levelIndex * learnablesPerLevel + 1)
+    learnables = [learnableData(courseId, levelIndex, p, mediaPerLearnable) for p in positions]
+    progress = [progressData(l['id'], p) for l, p in zip(learnables, positions)]
+    return {
+        'session_source_info': {
+            'level_id': courseId * 10000 + levelIndex,
+            'source_sub_index': levelIndex,
+            'level_name': 'Level {:d}'.format(levelIndex),
+        },
+        'learnables': learnables,
+        'progress': [p for p in progress if p],
+    }
+
+def coursePage(courseId, levelCount, learnablesPerLevel=20):
+    levels = "\n".join(
+        '<a class="level" href="/community/course/{0:d}/course/{1:d}/"><div class="level-index">{1:d}</div>'
+        '<div class="level-title">Level {1:d}</div></a>'.format(courseId, i) for i in range(1, levelCount + 1))
+    return """<!DOCTYPE html>
+<html>
+<head><title>Course {0:d}</title><script>window.__CONFIG__ = {{}};</script></head>
+<body>
+<div class="course-details">
+<h1 class="course-name">Synthetic Course {0:d}</h1>
+<span class="course-description">A generated course with {1:d} levels.</span>
+</div>
+<div class="progress-box"><div class="progress-box-title">0 / {2:d} words learned</div></div>
+<div class="levels clearfix">
+{3}
+</div>
+</body>
+</html>
+""".format(courseId, levelCount, levelCount * learnablesPerLevel, levels)
+
+class FakeMemriseHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body, contentType, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def failRequest(self):
+        server = self.server
+        server.count('requests')
+        if server.latency:
+            time.sleep(server.latency)
+        if server.isOverloaded():
+            server.count('throttled')
+            self.send(429, b'{"detail": "too many requests"}', 'application/json', {'Retry-After': str(server.retryAfter)})
+            return True
+        if server.errorRate and server.random.random() < server.errorRate:
+            server.count('errors')
+            self.send(server.errorStatus, b'{"detail": "injected error"}', 'application/json')
+            return True
+        return False
+
+    def do_GET(self):
+        if self.failRequest():
+            return
+        path = urllib.parse.urlparse(self.path).path
+        match = re.match(r'^/community/course/(\d+)/', path)
+        if match:
+            courseId = int(match.group(1))
+            body = coursePage(courseId, self.server.levelCount(courseId), self.server.learnablesPerLevel).encode('utf-8')
+            self.send(200, body, 'text/html; charset=utf-8')
+        elif re.match(r'^/(audio|image|video)/', path):
+            self.server.count('media')
+            content = self.server.mediaContent
+            match = re.match(r'^bytes=(\d+)-$', self.headers.get('Range', ''))
+            if not match:
+                self.send(200, content, 'application/octet-stream')
+            elif int(match.group(1)) >= len(content):
+                self.send(416, b'', 'application/octet-stream', {'Content-Range': 'bytes */{:d}'.format(len(content))})
+            else:
+                start = int(match.group(1))
+                self.server.count('ranges')
+                self.send(206, content[start:], 'application/octet-stream',
+                          {'Content-Range': 'bytes {:d}-{:d}/{:d}'.format(start, len(content) - 1, len(content))})
+        elif path == '/embed':
+            # an oEmbed endpoint answering like noembed.com
+            self.server.count('embeds')
+            url = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query).get('url', [''])[0]
+            if re.match(r'^https?://(www\.)?youtube\.com/', url):
+                data = {'type': 'video', 'url': url, 'html': '<iframe src="{}" allowfullscreen></iframe>'.format(url)}
+            else:
+                data = {'url': url, 'error': 'no matching providers found for {}'.format(url)}
+            self.send(200, json.dumps(data).encode('utf-8'), 'application/json')
+        elif path.startswith('/v1.25/me/'):
+            self.send(200, b'{}', 'application/json')
+        else:
+            self.send(404, b'not found', 'text/plain')
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.failRequest():
+            return
+        path = urllib.parse.urlparse(self.path).path
+        if path == '/v1.25/learning_sessions/preview/':
+            request = json.loads(body)
+            courseId = int(request['session_source_id'])
+            levelIndex = int(request['session_source_sub_index'])
+            if levelIndex < 1 or levelIndex > self.server.levelCount(courseId):
+                self.send(400, b'{"code": "invalid_level", "detail": "Level not found"}', 'application/json')
+                return
+            data = levelData(courseId, levelIndex, self.server.learnablesPerLevel, self.server.mediaPerLearnable)
+            self.send(200, json.dumps(data).encode('utf-8'), 'application/json')
+        else:
+            self.send(404, b'not found', 'text/plain')
+
+class FakeMemriseServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), levels=10, learnablesPerLevel=20, mediaPerLearnable=1, mediaSize=16*1024, latency=0.0, errorRate=0.0, errorStatus=503, maxRate=None, retryAfter=1, seed=None):
+        super(FakeMemriseServer, self).__init__(address, FakeMemriseHandler)
+        # levels is either a fixed level count or a dict courseId -> level count
+        self.levels = levels
+        self.learnablesPerLevel = learnablesPerLevel
+        self.mediaPerLearnable = mediaPerLearnable
+        self.mediaContent = bytes(random.Random(seed).getrandbits(8) for _ in range(mediaSize))
+        self.latency = latency
+        self.errorRate = errorRate
+        self.errorStatus = errorStatus
+        # requests per second above maxRate are answered with 429
+        self.maxRate = maxRate
+        self.retryAfter = retryAfter
+        self.recent = collections.deque()
+        self.random = random.Random(seed)
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def levelCount(self, courseId):
+        if isinstance(self.levels, dict):
+            return self.levels.get(courseId, 0)
+        return self.levels
+
+    def isOverloaded(self):
+        if not self.maxRate:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            while self.recent and now - self.recent[0] > 1.0:
+                self.recent.popleft()
+            if len(self.recent) >= self.maxRate:
+                return True
+            self.recent.append(now)
+            return False
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    @property
+    def url(self):
+        return "http://{}:{:d}".format(*self.server_address[:2])
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+class RedirectAdapter(requests.adapters.HTTPAdapter):
+    # sends every request of a session to the fake server, keeping the path
+    def __init__(self, baseUrl, *args, **kwargs):
+        super(RedirectAdapter, self).__init__(*args, **kwargs)
+        self.baseUrl = baseUrl
+
+    def send(self, request, *args, **kwargs):
+        url = urllib.parse.urlparse(request.url)
+        request.url = urllib.parse.urljoin(self.baseUrl, url.path + ("?" + url.query if url.query else ""))
+        return super(RedirectAdapter, self).send(request, *args, **kwargs)
+
+def redirectService(service, server, **kwargs):
+    kwargs.setdefault('max_retries', service.session.get_adapter("https://").max_retries)
+    adapter = RedirectAdapter(server.url, **kwargs)
+    service.session.mount("https://", adapter)
+    service.session.mount("http://", adapter)
+    return service
+
+if httpx is not None:
+    class RedirectTransport(httpx.AsyncBaseTransport):
+        # the httpx counterpart of RedirectAdapter, for memrise_async.AsyncService
+        def __init__(self, baseUrl, transport=None):
+            self.baseUrl = httpx.URL(baseUrl)
+            self.transport = transport or httpx.AsyncHTTPTransport()
+
+        async def handle_async_request(self, request):
+            request.url = request.url.copy_with(scheme=self.baseUrl.scheme, host=self.baseUrl.host, port=self.baseUrl.port)
+            request.headers['Host'] = self.baseUrl.netloc.decode('ascii')
+            return await self.transport.handle_async_request(request)
+
+        async def aclose(self):
+            await self.transport.aclose()
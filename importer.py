@@ -1,14 +1,15 @@
 ﻿# -*- coding: utf-8 -*-
 
-import http.cookiejar, os.path, uuid, sys, datetime, html
+import http.cookiejar, os.path, uuid, sys, html, threading, time
 import bs4
 from anki.media import MediaManager
+from anki.utils import ids2str
 from aqt import mw
 from aqt.qt import *
 from functools import partial
 
 
-from . import memrise, oembed
+from . import memrise, memrise_markdown, oembed
 
 def camelize(content):
 	return ''.join(x for x in content.title() if x.isalpha())
@@ -37,36 +38,74 @@ class MemriseCourseLoader(QObject):
 			self.totalLoaded = 0
 			self.thingsLoaded = 0
 			self.levelsLoaded = 0
+			self.mediaLoaded = 0
+			self.lock = threading.Lock()
+			self.mediaDownloader = None
+			if self.sender.downloadMedia:
+				self.mediaDownloader = memrise.MediaDownloader(self.sender.download, self.sender.maxConcurrentDownloads)
+			self.markdownMedia = None
+			if self.sender.renderMarkdown:
+				self.markdownMedia = memrise_markdown.MarkdownMedia(toAbsoluteUrl=self.sender.memriseService.toAbsoluteMediaUrl)
 
 		def levelLoaded(self, levelIndex, level=None):
 			self.levelsLoaded += 1
 			self.sender.levelsLoadedChanged.emit(self.levelsLoaded)
-			self.totalLoaded += 1
-			self.sender.totalLoadedChanged.emit(self.totalLoaded)
+			with self.lock:
+				self.totalLoaded += 1
+				self.sender.totalLoadedChanged.emit(self.totalLoaded)
 
 		def downloadMedia(self, learnable):
-			for fieldType in [memrise.FieldType.Image, memrise.FieldType.Audio, memrise.FieldType.Video]:
-				for colName in learnable.course.getColumnNames(fieldType):
-					for media in [f for f in learnable.getColumnData(colName, fieldType).getFiles() if not f.isDownloaded()]:
-						media.localUrl = self.sender.download(media.remoteUrl)
+			for media in learnable.course.getMediaFiles([learnable]):
+				if not media.isDownloaded():
+					self.enqueueMedia(media)
+			if self.markdownMedia is not None:
+				# images in text fields join the same downloads
+				for media in self.markdownMedia.collectLearnable(learnable):
+					self.enqueueMedia(media)
+
+		def enqueueMedia(self, media):
+			isQueued = media.remoteUrl in self.mediaDownloader
+			future = self.mediaDownloader.enqueue(media)
+			if not isQueued:
+				with self.lock:
+					self.totalCount += 1
+					self.sender.totalCountChanged.emit(self.totalCount)
+				future.add_done_callback(self.mediaDownloaded)
+
+		def mediaDownloaded(self, future):
+			with self.lock:
+				self.mediaLoaded += 1
+				self.totalLoaded += 1
+				self.sender.totalLoadedChanged.emit(self.totalLoaded)
+
+		def joinDownloads(self):
+			if self.mediaDownloader:
+				self.mediaDownloader.join()
+
+		def closeDownloads(self):
+			if self.mediaDownloader:
+				self.mediaDownloader.close()
 
 		def thingLoaded(self, learnable):
-			if learnable and self.sender.downloadMedia:
+			if learnable and self.mediaDownloader:
 				self.downloadMedia(learnable)
 			self.thingsLoaded += 1
 			self.sender.thingsLoadedChanged.emit(self.thingsLoaded)
-			self.totalLoaded += 1
-			self.sender.totalLoadedChanged.emit(self.totalLoaded)
+			with self.lock:
+				self.totalLoaded += 1
+				self.sender.totalLoadedChanged.emit(self.totalLoaded)
 
 		def levelCountChanged(self, levelCount):
 			self.sender.levelCountChanged.emit(levelCount)
-			self.totalCount += levelCount
-			self.sender.totalCountChanged.emit(self.totalCount)
+			with self.lock:
+				self.totalCount += levelCount
+				self.sender.totalCountChanged.emit(self.totalCount)
 
 		def thingCountChanged(self, thingCount):
 			self.sender.thingCountChanged.emit(thingCount)
-			self.totalCount += thingCount
-			self.sender.totalCountChanged.emit(self.totalCount)
+			with self.lock:
+				self.totalCount += thingCount
+				self.sender.totalCountChanged.emit(self.totalCount)
 
 		def __getattr__(self, attr):
 			if hasattr(self.sender, attr):
@@ -84,13 +123,19 @@ class MemriseCourseLoader(QObject):
 		self.skipExistingMedia = True
 		self.askerFunction = None
 		self.ignoreDownloadErrors = False
+		self.maxConcurrentLevels = 4
+		self.maxConcurrentDownloads = 8
+		self.knownLevelDigests = None
+		self.verifyMedia = False
+		self.renderMarkdown = False
+		self.markdownMedia = None
 
 	def download(self, url):
 		import urllib.request, urllib.error, urllib.parse
 		while True:
 			try:
 				return self.memriseService.downloadMedia(url, skipExisting=self.skipExistingMedia)
-			except (urllib.error.HTTPError, urllib.error.URLError) as e:
+			except (urllib.error.HTTPError, urllib.error.URLError, memrise.IncompleteDownloadError, memrise.MediaDownloadError) as e:
 				if self.ignoreDownloadErrors:
 					return None
 				if callable(self.askerFunction) and hasattr(self.askerFunction, '__self__'):
@@ -126,11 +171,18 @@ class MemriseCourseLoader(QObject):
 	def run(self):
 		self.result = None
 		self.exc_info = (None,None,None)
+		observer = MemriseCourseLoader.Observer(self)
+		self.markdownMedia = observer.markdownMedia
 		try:
-			course = self.memriseService.loadCourse(self.url, MemriseCourseLoader.Observer(self))
+			# only the known files of this course are checked, once per url
+			self.memriseService.verifyExistingMedia = self.verifyMedia
+			course = self.memriseService.loadCourse(self.url, observer, maxConcurrentLevels=self.maxConcurrentLevels, knownLevelDigests=self.knownLevelDigests, lazyDates=True)
+			observer.joinDownloads()
 			self.result = course
 		except Exception:
 			self.exc_info = sys.exc_info()
+		finally:
+			observer.closeDownloads()
 		self.finished.emit()
 
 class DownloadFailedBox(QMessageBox):
@@ -601,6 +653,45 @@ class FieldMappingDialog(QDialog):
 
 		return mapping
 
+class CollectionWriter(object):
+	def __init__(self, col, chunkSize=500):
+		self.col = col
+		self.chunkSize = chunkSize
+		self.notes = {}
+		self.cards = {}
+		self.suspendedCardIds = set()
+
+	def updateNote(self, note):
+		self.notes[note.id] = note
+		if len(self.notes) >= self.chunkSize:
+			self.flushNotes()
+
+	def updateCard(self, card):
+		self.cards[card.id] = card
+		if len(self.cards) >= self.chunkSize:
+			self.flushCards()
+
+	def suspendCards(self, cardIds):
+		self.suspendedCardIds.update(cardIds)
+
+	def flushNotes(self):
+		if self.notes:
+			self.col.update_notes(list(self.notes.values()))
+			self.notes = {}
+
+	def flushCards(self):
+		if self.cards:
+			self.col.update_cards(list(self.cards.values()))
+			self.cards = {}
+
+	def flush(self):
+		self.flushNotes()
+		self.flushCards()
+		# suspend last, otherwise pending card updates would reset the queue
+		if self.suspendedCardIds:
+			self.col.sched.suspendCards(list(self.suspendedCardIds))
+			self.suspendedCardIds = set()
+
 class MemriseImportDialog(QDialog):
 	def __init__(self, memriseService):
 		super(MemriseImportDialog, self).__init__()
@@ -650,19 +741,44 @@ class MemriseImportDialog(QDialog):
 			checkbox.setChecked(predicate(index))
 		self.deckSelection.currentIndexChanged.connect(partial(setScheduler,self.importScheduleCheckBox,lambda i: i==0))
 
+		self.skipUnchangedLevelsCheckBox = QCheckBox("Skip unchanged levels")
+		self.skipUnchangedLevelsCheckBox.setEnabled(False)
+		self.skipUnchangedLevelsCheckBox.setToolTip("Levels that didn't change since the last import of this deck are neither downloaded again nor updated.")
+		layout.addWidget(self.skipUnchangedLevelsCheckBox)
+		self.deckSelection.currentIndexChanged.connect(partial(setScheduler,self.skipUnchangedLevelsCheckBox,lambda i: i!=0))
+		self.deckSelection.currentIndexChanged.connect(lambda i: self.skipUnchangedLevelsCheckBox.setEnabled(i!=0))
+
 		self.downloadMediaCheckBox = QCheckBox("Download media files")
 		layout.addWidget(self.downloadMediaCheckBox)
 
 		self.skipExistingMediaCheckBox = QCheckBox("Skip download of existing media files")
 		layout.addWidget(self.skipExistingMediaCheckBox)
 
+		self.dedupeMediaCheckBox = QCheckBox("Store identical media files only once")
+		self.dedupeMediaCheckBox.setToolTip("Media files are named after their content, so the same file served under different addresses is downloaded and stored once.")
+		layout.addWidget(self.dedupeMediaCheckBox)
+
 		self.downloadMediaCheckBox.stateChanged.connect(self.skipExistingMediaCheckBox.setEnabled)
+		self.verifyMediaCheckBox = QCheckBox("Check that known media files still exist")
+		self.verifyMediaCheckBox.setToolTip("Media files of the course which were removed or changed in size since they were downloaded are downloaded again.")
+		layout.addWidget(self.verifyMediaCheckBox)
+
+		self.downloadMediaCheckBox.stateChanged.connect(self.dedupeMediaCheckBox.setEnabled)
+		self.downloadMediaCheckBox.stateChanged.connect(self.verifyMediaCheckBox.setEnabled)
 		self.downloadMediaCheckBox.setChecked(True)
 		self.skipExistingMediaCheckBox.setChecked(True)
 
+		self.renderMarkdownCheckBox = QCheckBox("Render formatting in text fields")
+		self.renderMarkdownCheckBox.setToolTip("Markdown in text fields, like **bold** or img: links, is converted to HTML. Images in it are downloaded with the other media files.")
+		layout.addWidget(self.renderMarkdownCheckBox)
+
 		self.ignoreDownloadErrorsCheckBox = QCheckBox("Ignore download errors")
 		layout.addWidget(self.ignoreDownloadErrorsCheckBox)
 
+		self.cacheResponsesCheckBox = QCheckBox("Cache course data for repeated imports")
+		self.cacheResponsesCheckBox.setToolTip("Course and level data is kept for a day and reused instead of downloading it again.")
+		layout.addWidget(self.cacheResponsesCheckBox)
+
 		layout.addWidget(QLabel("Keep in mind that it can take a substantial amount of time to download \nand import your course. Good things come to those who wait!"))
 
 		self.buttons = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel, Qt.Orientation.Horizontal, self)
@@ -690,6 +806,8 @@ class MemriseImportDialog(QDialog):
 		self.loader.finished.connect(self.importCourse)
 		self.loader.askerFunction = DownloadFailedBox().askRetry
 
+		self.progressInterval = 0.1
+
 		self.modelMapper = ModelMappingDialog(mw.col)
 		self.fieldMapper = FieldMappingDialog(mw.col)
 		self.templateMapper = TemplateMappingDialog(mw.col)
@@ -750,6 +868,31 @@ class MemriseImportDialog(QDialog):
 		deck.setdefault('addons', {}).setdefault('memrise', {})["url"] = url
 		mw.col.decks.save(deck)
 
+	def loadDeckLevelDigests(self, name, url):
+		did = mw.col.decks.id(name, create=False)
+		if did:
+			memriseInfo = mw.col.decks.get(did, default=False).get("addons", {}).get("memrise", {})
+			if memriseInfo.get("url") == url:
+				return {int(k): v for k, v in memriseInfo.get("levels", {}).items()}
+		return {}
+
+	def saveDeckLevelDigests(self, deck, digests):
+		deck.setdefault('addons', {}).setdefault('memrise', {})["levels"] = {str(k): v for k, v in digests.items()}
+		mw.col.decks.save(deck)
+
+	def getCompleteLevelDigests(self, course):
+		# levels with media which wasn't downloaded are not skipped next time, so it is fetched then
+		digests = dict(course.levelDigests)
+		markdownMedia = self.loader.markdownMedia
+		for level in course:
+			files = list(course.getMediaFiles(level))
+			if markdownMedia is not None:
+				for learnable in level:
+					files.extend(markdownMedia.getLearnableFiles(learnable))
+			if not all(media.isDownloaded() for media in files):
+				digests.pop(level.index, None)
+		return digests
+
 	def saveDeckModelRelation(self, deck, model):
 		if model['did'] != deck["id"]:
 			deck['mid'] = model['id']
@@ -758,16 +901,42 @@ class MemriseImportDialog(QDialog):
 			model["did"] = deck["id"]
 			mw.col.models.save(model)
 
-	def findExistingNote(self, deckName, course, learnable):
-		notes = mw.col.find_notes('deck:"{}" "{}:re:(,|^){}(,|$)"'.format(deckName, 'Learnable', learnable.id))
-		if notes:
-			return mw.col.get_note(notes[0])
+	def findExistingNotes(self, deckName):
+		noteIds = {}
+		nids = mw.col.find_notes('deck:"{}" "{}:_*"'.format(deckName, 'Learnable'))
+		if not nids:
+			return noteIds
+
+		learnableFieldOrds = {}
+		for nid, mid, flds in mw.col.db.all("select id, mid, flds from notes where id in {}".format(ids2str(nids))):
+			if not mid in learnableFieldOrds:
+				fieldMap = mw.col.models.field_map(mw.col.models.get(mid))
+				learnableFieldOrds[mid] = fieldMap['Learnable'][0] if 'Learnable' in fieldMap else None
+			ordinal = learnableFieldOrds[mid]
+			if ordinal is None:
+				continue
+			for learnableId in flds.split("\x1f")[ordinal].split(','):
+				learnableId = learnableId.strip()
+				if learnableId.isdigit():
+					noteIds.setdefault(int(learnableId), nid)
+
+		return noteIds
+
+	def findExistingNote(self, existingNotes, learnable, notesById):
+		nid = existingNotes.get(learnable.id)
+		if nid:
+			# one Note object per nid, so later updates don't overwrite earlier ones
+			if nid not in notesById:
+				notesById[nid] = mw.col.get_note(nid)
+			return notesById[nid]
 
 		return None
 
 	def getWithSpec(self, learnable, spec):
 		values = spec.get(learnable)
 		if spec.field.type == memrise.FieldType.Text:
+			if self.loader.markdownMedia is not None:
+				return list(map(self.loader.markdownMedia.render, values))
 			return list(map(self.prepareText, values))
 		elif spec.field.type == memrise.FieldType.Image:
 			return list(map(self.prepareImage, list(filter(bool, values))))
@@ -794,6 +963,7 @@ class MemriseImportDialog(QDialog):
 			exc_info = self.loader.getExceptionInfo()
 			raise exc_info[0](exc_info[1]).with_traceback(exc_info[2])
 
+		undoEntry = mw.col.add_custom_undo_entry("Import Memrise Course")
 		try:
 			self.progressBar.setValue(0)
 			self.progressBar.setFormat("Importing: %p% (%v/%m)")
@@ -801,6 +971,10 @@ class MemriseImportDialog(QDialog):
 			course = self.loader.getResult()
 
 			noteCache = {}
+			notesById = {}
+			writer = CollectionWriter(mw.col)
+			importedCount = 0
+			lastProgressUpdate = time.monotonic()
 
 			deck = None
 			if self.deckSelection.currentIndex() != 0:
@@ -808,14 +982,17 @@ class MemriseImportDialog(QDialog):
 			else:
 				deck = self.selectDeck(course.title, merge=False)
 			self.saveDeckUrl(deck, self.courseUrlLineEdit.text())
+			existingNotes = self.findExistingNotes(deck['name'])
+			intervals, dueOffsets = course.progress.schedule()
+			today = mw.col.sched.today
 
 			for level in course:
-				tags = self.getLevelTags(len(course), level)
+				tags = self.getLevelTags(max(course.levelCount, len(course)), level)
 				for learnable in level:
 					if learnable.id in noteCache:
 						ankiNote = noteCache[learnable.id]
 					else:
-						ankiNote = self.findExistingNote(deck['name'], course, learnable)
+						ankiNote = self.findExistingNote(existingNotes, learnable, notesById)
 					if not ankiNote:
 						model = self.modelMapper.getModel(learnable, deck)
 						self.saveDeckModelRelation(deck, model)
@@ -834,14 +1011,24 @@ class MemriseImportDialog(QDialog):
 						ankiNote['Level'] = ', '.join(sorted(levels))
 
 					if 'Learnable' in list(ankiNote.keys()):
-						ankiNote['Learnable'] = ','.join(map(str, sorted(learnable.identifiers)))
+						previousIdentifiers = set(int(x) for x in ankiNote['Learnable'].split(',') if x.strip().isdigit())
+						identifiers = set(learnable.identifiers)
+						if course.skippedLevels:
+							# duplicates from skipped levels are unknown, keep their ids
+							identifiers.update(previousIdentifiers)
+						ankiNote['Learnable'] = ','.join(map(str, sorted(identifiers)))
+						# learnables which are no longer similar get notes of their own
+						for learnableId in previousIdentifiers - identifiers:
+							if existingNotes.get(learnableId) == ankiNote.id:
+								del existingNotes[learnableId]
 
 					for tag in tags:
 						ankiNote.add_tag(tag)
 
 					if not ankiNote.cards():
 						mw.col.add_note(ankiNote, deck['id'])
-					mw.col.update_note(ankiNote)
+					else:
+						writer.updateNote(ankiNote)
 					for learnable_id in learnable.identifiers:
 						noteCache[learnable_id] = ankiNote
 
@@ -863,28 +1050,37 @@ class MemriseImportDialog(QDialog):
 								else:
 									card.type = 2
 									card.queue = 2
-									card.ivl = int(round(scheduleInfo.interval))
+									card.ivl = intervals[scheduleInfo.row]
 									card.reps = scheduleInfo.attempts
 									card.lapses = scheduleInfo.incorrect
-									card.due = mw.col.sched.today + (scheduleInfo.next_date.date() - datetime.datetime.now(datetime.timezone.utc).date()).days
+									card.due = today + dueOffsets[scheduleInfo.row]
 									card.factor = 2500
-								mw.col.update_card(card)
+								writer.updateCard(card)
 							if scheduleInfo.ignored:
-								mw.col.sched.suspendCards([card.id for card in cards])
+								writer.suspendCards([card.id for card in cards])
 						else:
 							for card in cards:
 								if card.type == 0 and card.queue == 0:
 									card.due = scheduleInfo.position
-									mw.col.update_card(card)
+									writer.updateCard(card)
 
-					self.progressBar.setValue(self.progressBar.value()+1)
-					QApplication.processEvents()
+					importedCount += 1
+					if time.monotonic() - lastProgressUpdate >= self.progressInterval:
+						self.progressBar.setValue(importedCount)
+						QApplication.processEvents()
+						lastProgressUpdate = time.monotonic()
+
+			writer.flush()
+			self.saveDeckLevelDigests(deck, self.getCompleteLevelDigests(course))
+			self.progressBar.setValue(importedCount)
 
 		except Exception:
 			self.buttons.show()
 			self.progressBar.hide()
 			exc_info = sys.exc_info()
 			raise exc_info[0](exc_info[1]).with_traceback(exc_info[2])
+		finally:
+			mw.col.merge_undo_entries(undoEntry)
 
 		mw.reset()
 
@@ -907,8 +1103,33 @@ class MemriseImportDialog(QDialog):
 		self.loader.downloadMedia = self.downloadMediaCheckBox.isChecked()
 		self.loader.skipExistingMedia = self.skipExistingMediaCheckBox.isChecked()
 		self.loader.ignoreDownloadErrors = self.ignoreDownloadErrorsCheckBox.isChecked()
+		self.loader.knownLevelDigests = None
+		if self.deckSelection.currentIndex() != 0 and self.skipUnchangedLevelsCheckBox.isChecked():
+			self.loader.knownLevelDigests = self.loadDeckLevelDigests(self.deckSelection.currentText(), courseUrl)
+		self.setResponseCache(self.cacheResponsesCheckBox.isChecked())
+		self.loader.verifyMedia = self.verifyMediaCheckBox.isChecked()
+		self.loader.renderMarkdown = self.renderMarkdownCheckBox.isChecked()
+		self.setMediaStore(self.downloadMediaCheckBox.isChecked(), self.dedupeMediaCheckBox.isChecked())
 		self.loader.start(courseUrl)
 
+	def setResponseCache(self, enabled):
+		service = self.loader.memriseService
+		if not enabled:
+			service.responseCache = None
+		elif service.responseCache is None:
+			cachefilename = os.path.join(mw.pm.profileFolder(), 'memrise.cache')
+			service.responseCache = memrise.ResponseCache(cachefilename, ttl=24*60*60)
+
+	def setMediaStore(self, enabled, contentAddressed):
+		service = self.loader.memriseService
+		if not enabled:
+			service.mediaStore = None
+			return
+		if service.mediaStore is None:
+			storefilename = os.path.join(mw.pm.profileFolder(), 'memrise.media')
+			service.mediaStore = memrise.MediaStore(storefilename)
+		service.mediaStore.contentAddressed = contentAddressed
+
 def startCourseImporter():
 	downloadDirectory = MediaManager(mw.col, None).dir()
 	cookiefilename = os.path.join(mw.pm.profileFolder(), 'memrise.cookies')
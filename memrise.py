@@ -1,9 +1,21 @@
 import urllib.request, urllib.error, urllib.parse, http.cookiejar, http.client
 import re, os.path, json, collections, datetime, uuid, itertools, hashlib, enum
+import html as htmlmodule
+import concurrent.futures, sqlite3, threading, time, zlib, email.utils, array, math
 import bs4
 import requests.adapters, requests.sessions
 from urllib3.util.retry import Retry
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 def sanitizeName(name, default=""):
     name = re.sub(r"<.*?>", "", name)
     name = re.sub(r"\s\s+", "", name)
@@ -13,16 +25,35 @@ def sanitizeName(name, default=""):
         return default
     return name
 
+try:
+    datetime.datetime.fromisoformat('2000-01-01T00:00:00Z')
+    isoFormatAcceptsZ = True
+except ValueError:
+    isoFormatAcceptsZ = False
+
 def parse_date(iso_str):
-    try:
-        dt = datetime.datetime.fromisoformat(iso_str)
-    except ValueError:
-        dt = datetime.datetime.fromisoformat(iso_str.replace('Z', '+00:00'))
+    # Memrise dates end with Z, which fromisoformat only accepts since Python 3.11
+    if not isoFormatAcceptsZ and iso_str.endswith('Z'):
+        iso_str = iso_str[:-1] + '+00:00'
+    dt = datetime.datetime.fromisoformat(iso_str)
     if dt.tzinfo is None:
-        dt.replace(tzinfo=datetime.timezone.utc)
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
     return dt
 
+timestampCache = {}
+
+def parse_timestamp(iso_str):
+    # memoised, a plain dict is cleared when full as it is cheaper to miss than an lru cache
+    timestamp = timestampCache.get(iso_str)
+    if timestamp is None:
+        if len(timestampCache) >= 16384:
+            timestampCache.clear()
+        timestamp = timestampCache[iso_str] = parse_date(iso_str).timestamp()
+    return timestamp
+
 class Direction(object):
+    __slots__ = ('front', 'back')
+
     def __init__(self, front=None, back=None):
         self.front = front
         self.back = back
@@ -81,7 +112,15 @@ class Course(object):
         
         self.nextPosition = 1
         
+        # levels of the course, len() only counts the loaded ones
+        self.levelCount = 0
         self.levels = []
+        self.learnables = {}
+        self.progress = ProgressTable()
+
+        self.levelDigests = {}
+        self.skippedLevels = []
+        self.skippedLearnableIds = set()
         
         self.columns = collections.OrderedDict()
         self.attributes = collections.OrderedDict()
@@ -108,7 +147,10 @@ class Course(object):
     def similar_learnables(self):
         learnables = {}
         for learnable in self.all_learnables():
-            learnables.setdefault(learnable.checksum(), []).append(learnable)
+            fingerprint = learnable.fingerprint
+            if fingerprint is None:
+                fingerprint = learnable.updateFingerprint()
+            learnables.setdefault(fingerprint, []).append(learnable)
         return learnables
 
     def getNextPosition(self):
@@ -117,16 +159,34 @@ class Course(object):
         return nextPosition
 
     def hasLearnable(self, learnableId):
-        for level in self.levels:
-            if level.hasLearnable(learnableId):
-                return True
-        return False
+        return learnableId in self.learnables
 
     def getLearnable(self, learnableId):
-        for level in self.levels:
-            if level.hasLearnable(learnableId):
-                return level.getLearnable(learnableId)
-        return None
+        return self.learnables.get(learnableId)
+
+    def addLevel(self, level):
+        # learnables are indexed once their level belongs to the course, so a
+        # level repeating a learnable still gets a new one, as in level scans
+        level.course = self
+        self.levels.append(level)
+        for learnable in level:
+            self.indexLearnable(learnable)
+
+    def indexLearnable(self, learnable):
+        self.learnables.setdefault(learnable.id, learnable)
+
+    def rebuildLearnableIndex(self):
+        self.learnables = {}
+        for learnable in self.all_learnables():
+            self.indexLearnable(learnable)
+
+    def isLearnableIndexValid(self):
+        learnables = {}
+        for learnable in self.all_learnables():
+            learnables.setdefault(learnable.id, learnable)
+        if learnables.keys() != self.learnables.keys():
+            return False
+        return all(learnables[k] is self.learnables[k] for k in learnables)
     
     def getDirections(self):
         return list(set(itertools.chain(*map(lambda x: x.getDirections(), self.levels))))
@@ -162,6 +222,17 @@ class Course(object):
     def getColumnNamesByType(self, fieldType):
         return list(self.columnsByType.get(fieldType, {}).keys())
 
+    def getMediaFiles(self, learnables=None):
+        # image, audio and video files of the given learnables, or of all of them
+        if learnables is None:
+            learnables = self.all_learnables()
+        columns = [(fieldType, self.getColumnNames(fieldType)) for fieldType in [FieldType.Image, FieldType.Audio, FieldType.Video]]
+        for learnable in learnables:
+            for fieldType, colNames in columns:
+                for colName in colNames:
+                    for media in learnable.getColumnData(colName, fieldType).getFiles():
+                        yield media
+
     def getAttributeNames(self):
         return list(self.attributes.keys())
 
@@ -198,20 +269,159 @@ class Course(object):
     def countAttributes(self):
         return len(self.attributes)
 
+def toTimestamp(date):
+    if date is None:
+        return math.nan
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return date.timestamp()
+
+def fromTimestamp(timestamp):
+    if math.isnan(timestamp):
+        return None
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+
+def toInterval(interval):
+    return math.nan if interval is None else float(interval)
+
+def fromInterval(interval):
+    return None if math.isnan(interval) else interval
+
+def toCount(value):
+    # counters may be null in the progress data
+    return 0 if value is None else value
+
+class ProgressTable(object):
+    # progress of all learnables of a course, one array per field, so the
+    # schedule can be converted for the whole course at once. Dates are
+    # stored as UTC timestamps, missing dates and intervals as nan, missing
+    # counters as 0. With lazyDates, dates assigned as ISO strings are only
+    # parsed when read.
+    Fields = collections.OrderedDict([
+        ('ignored', ('b', 0)),
+        ('last_date', ('d', math.nan)),
+        ('created_date', ('d', math.nan)),
+        ('next_date', ('d', math.nan)),
+        ('interval', ('d', math.nan)),
+        ('growth_level', ('q', 0)),
+        ('attempts', ('q', 0)),
+        ('correct', ('q', 0)),
+        ('incorrect', ('q', 0)),
+        ('total_streak', ('q', 0)),
+        ('current_streak', ('q', 0)),
+        ('position', ('q', 0)),
+    ])
+    DateFields = ('last_date', 'created_date', 'next_date')
+
+    def __init__(self, lazyDates=False):
+        self.columns = {name: array.array(typecode) for name, (typecode, default) in self.Fields.items()}
+        self.lazyDates = lazyDates
+        self.rawDates = {name: {} for name in self.DateFields}
+
+    def __len__(self):
+        return len(self.columns['position'])
+
+    def addRow(self):
+        for name, (typecode, default) in self.Fields.items():
+            self.columns[name].append(default)
+        return len(self) - 1
+
+    def addProgress(self):
+        return Progress(self, self.addRow())
+
+    def getDate(self, name, row):
+        rawDates = self.rawDates[name]
+        if rawDates and row in rawDates:
+            self.columns[name][row] = parse_timestamp(rawDates.pop(row))
+        return self.columns[name][row]
+
+    def setDate(self, name, row, value):
+        # value is a datetime, an ISO string or None
+        if isinstance(value, str):
+            if self.lazyDates:
+                self.rawDates[name][row] = value
+                return
+            timestamp = parse_timestamp(value)
+        else:
+            timestamp = toTimestamp(value)
+        rawDates = self.rawDates[name]
+        if rawDates:
+            rawDates.pop(row, None)
+        self.columns[name][row] = timestamp
+
+    def resolveDates(self, name):
+        rawDates = self.rawDates[name]
+        column = self.columns[name]
+        for row, value in rawDates.items():
+            column[row] = parse_timestamp(value)
+        rawDates.clear()
+
+    def schedule(self, now=None):
+        # returns the rounded intervals and the due offsets in days from today,
+        # in row order, both 0 where there is no interval or next date
+        if now is None:
+            now = time.time()
+        today = math.floor(now / 86400)
+        self.resolveDates('next_date')
+        if numpy is not None:
+            intervals = numpy.frombuffer(self.columns['interval'], dtype=numpy.float64)
+            nextDates = numpy.frombuffer(self.columns['next_date'], dtype=numpy.float64)
+            with numpy.errstate(invalid='ignore'):
+                intervals = numpy.where(numpy.isnan(intervals), 0, numpy.rint(intervals)).astype(numpy.int64)
+                dueOffsets = numpy.where(numpy.isnan(nextDates), 0, numpy.floor(nextDates / 86400) - today).astype(numpy.int64)
+            return intervals.tolist(), dueOffsets.tolist()
+        intervals = [0 if math.isnan(i) else int(round(i)) for i in self.columns['interval']]
+        dueOffsets = [0 if math.isnan(d) else math.floor(d / 86400) - today for d in self.columns['next_date']]
+        return intervals, dueOffsets
+
+class ProgressField(object):
+    def __init__(self, name, toValue=None, fromValue=None):
+        self.name = name
+        self.toValue = toValue
+        self.fromValue = fromValue
+
+    def __get__(self, progress, owner=None):
+        if progress is None:
+            return self
+        value = progress.table.columns[self.name][progress.row]
+        return self.fromValue(value) if self.fromValue else value
+
+    def __set__(self, progress, value):
+        progress.table.columns[self.name][progress.row] = self.toValue(value) if self.toValue else value
+
+class ProgressDateField(ProgressField):
+    def __get__(self, progress, owner=None):
+        if progress is None:
+            return self
+        return fromTimestamp(progress.table.getDate(self.name, progress.row))
+
+    def __set__(self, progress, value):
+        progress.table.setDate(self.name, progress.row, value)
+
 class Progress(object):
-    def __init__(self):
-        self.ignored = False
-        self.last_date = None
-        self.created_date = None
-        self.next_date = None
-        self.interval = None
-        self.growth_level = 0
-        self.attempts = 0
-        self.correct = 0
-        self.incorrect = 0
-        self.total_streak = 0
-        self.current_streak = 0
-        self.position = 0
+    # view of one row of a ProgressTable, a standalone progress gets a table of its own
+    __slots__ = ('table', 'row')
+
+    ignored = ProgressField('ignored', int, bool)
+    last_date = ProgressDateField('last_date')
+    created_date = ProgressDateField('created_date')
+    next_date = ProgressDateField('next_date')
+    interval = ProgressField('interval', toInterval, fromInterval)
+    growth_level = ProgressField('growth_level', toCount)
+    attempts = ProgressField('attempts', toCount)
+    correct = ProgressField('correct', toCount)
+    incorrect = ProgressField('incorrect', toCount)
+    total_streak = ProgressField('total_streak', toCount)
+    current_streak = ProgressField('current_streak', toCount)
+    position = ProgressField('position')
+
+    def __init__(self, table=None, row=None):
+        if table is None:
+            table = ProgressTable()
+        if row is None:
+            row = table.addRow()
+        self.table = table
+        self.row = row
 
 class Level(object):
     def __init__(self, levelId):
@@ -237,27 +447,42 @@ class Level(object):
     def addLearnable(self, learnable):
         self.learnables[learnable.id] = learnable
         learnable.level = self
+        if self.course is not None:
+            self.course.indexLearnable(learnable)
 
     def getDirections(self):
         return list(set(map(lambda x: x.direction, self.learnables.values())))
 
 class ColumnData(object):
+    __slots__ = ()
+
     def checksum(self):
         return None
 
+    def fingerprint(self):
+        return None
+
 class TextColumnData(ColumnData):
+    # empty fields share the empty tuple, assign a new list instead of appending
+    __slots__ = ('values', 'alternatives', 'hiddenAlternatives', 'typingCorrects')
+
     def __init__(self):
-        self.values = []
-        self.alternatives = []
-        self.hiddenAlternatives = []
-        self.typingCorrects = []
+        self.values = ()
+        self.alternatives = ()
+        self.hiddenAlternatives = ()
+        self.typingCorrects = ()
 
     def checksum(self):
         hasher = hashlib.blake2b()
         hasher.update(json.dumps([self.values, self.alternatives, self.hiddenAlternatives], sort_keys=True).encode())
         return hasher.hexdigest()
 
+    def fingerprint(self):
+        return (tuple(self.values), tuple(self.alternatives), tuple(self.hiddenAlternatives))
+
 class DownloadableFile(object):
+    __slots__ = ('remoteUrl', 'localUrl')
+
     def __init__(self, remoteUrl=None):
         self.remoteUrl = remoteUrl
         self.localUrl = None
@@ -266,16 +491,16 @@ class DownloadableFile(object):
         return bool(self.localUrl)
 
 class MediaColumnData(ColumnData):
-    files = []
+    __slots__ = ('files',)
 
-    def __init__(self, files=[]):
+    def __init__(self, files=()):
         self.setFiles(files)
 
     def getFiles(self):
         return self.files
 
     def setFiles(self, files):
-        self.files = list(map(lambda f: f if isinstance(DownloadableFile) else DownloadableFile(f), files))
+        self.files = list(map(lambda f: f if isinstance(f, DownloadableFile) else DownloadableFile(f), files))
 
     def getRemoteUrls(self):
         return [f.remoteUrl for f in self.files]
@@ -306,6 +531,9 @@ class MediaColumnData(ColumnData):
         hasher.update(json.dumps([[f.remoteUrl, f.localUrl] for f in self.files], sort_keys=True).encode())
         return hasher.hexdigest()
 
+    def fingerprint(self):
+        return tuple(f.remoteUrl for f in self.files)
+
 def instanceColumnData(fieldType):
     if fieldType == FieldType.Text:
         return TextColumnData()
@@ -313,29 +541,56 @@ def instanceColumnData(fieldType):
         return MediaColumnData()
 
 class AttributeData(ColumnData):
+    __slots__ = ('values',)
+
     def __init__(self):
-        self.values = []
+        self.values = ()
 
     def checksum(self):
         hasher = hashlib.blake2b()
         hasher.update(json.dumps(self.values, sort_keys=True).encode())
         return hasher.hexdigest()
 
+    def fingerprint(self):
+        return tuple(self.values)
+
 class Learnable(object):
-    def __init__(self, learnableId):
+    __slots__ = ('id', '_identifiers', 'course', 'level', 'direction', 'progress',
+                 'columnData', 'columnTypes', 'attributeData', 'fingerprint')
+
+    def __init__(self, learnableId, progress=None):
         self.id = learnableId
-        self.identifiers = set([learnableId])
+        # only allocated once similar learnables are merged
+        self._identifiers = None
 
         self.course = None
         self.level = None
         self.direction = None
-        self.progress = Progress()
+        self.progress = progress if progress is not None else Progress()
 
         self.columnData = {}
-        self.columnDataByType = {}
-        for colType in Column.Types:
-            self.columnDataByType[colType] = {}
+        self.columnTypes = {}
         self.attributeData = {}
+        self.fingerprint = None
+
+    @property
+    def identifiers(self):
+        if self._identifiers is None:
+            return frozenset([self.id])
+        return self._identifiers
+
+    def addIdentifiers(self, identifiers):
+        if self._identifiers is None:
+            self._identifiers = set([self.id])
+        self._identifiers.update(identifiers)
+
+    @property
+    def columnDataByType(self):
+        # built on demand, lookups by type go through columnTypes
+        columnDataByType = {}
+        for name, data in self.columnData.items():
+            columnDataByType.setdefault(self.columnTypes[name], {})[name] = data
+        return columnDataByType
 
     def checksum(self):
         hasher = hashlib.blake2b()
@@ -343,6 +598,15 @@ class Learnable(object):
         hasher.update(json.dumps({k: v.checksum() for k, v in self.attributeData.items()}, sort_keys=True).encode())
         return hasher.hexdigest()
 
+    def updateFingerprint(self):
+        # hashable summary of the column and attribute data, used to find
+        # duplicates without serialising the data again
+        self.fingerprint = (
+            tuple(sorted((k, v.fingerprint()) for k, v in self.columnData.items())),
+            tuple(sorted((k, v.fingerprint()) for k, v in self.attributeData.items()))
+        )
+        return self.fingerprint
+
     def getColumnData(self, nameOrColumn, fieldType=None):
         if isinstance(nameOrColumn, Column):
             name = nameOrColumn.name
@@ -350,14 +614,16 @@ class Learnable(object):
         else:
             name = nameOrColumn
         if fieldType:
-            return self.columnDataByType.get(fieldType, {}).get(name, instanceColumnData(fieldType))
+            if self.columnTypes.get(name) != fieldType:
+                return instanceColumnData(fieldType)
+            return self.columnData[name]
         return self.columnData.get(name)
 
     def getAttributeData(self, name):
         return self.attributeData.get(name, AttributeData())
 
     def setColumnData(self, column, data):
-        self.columnDataByType[column.type][column.name] = data
+        self.columnTypes[column.name] = column.type
         self.columnData[column.name] = data
 
     def setAttributeData(self, nameOrAttribute, data):
@@ -368,11 +634,25 @@ class Learnable(object):
         self.attributeData[name] = data
 
 class CourseLoader(object):
-    def __init__(self, service):
+    # the only screens loadLevel reads, the others are dropped while parsing
+    ScreenTemplates = ('presentation', 'typing')
+
+    def __init__(self, service, maxConcurrentLevels=1, knownLevelDigests=None, lazyDates=False):
         self.service = service
         self.observers = []
         self.levelCount = 0
         self.learnableCount = 0
+        self.maxConcurrentLevels = maxConcurrentLevels
+        self.knownLevelDigests = knownLevelDigests or {}
+        self.lazyDates = lazyDates
+        self.directions = {}
+
+    def getDirection(self, front, back):
+        # learnables share their direction, there are only a few per course
+        direction = self.directions.get((front, back))
+        if direction is None:
+            direction = self.directions[(front, back)] = Direction(front, back)
+        return direction
 
     def registerObserver(self, observer):
         self.observers.append(observer)
@@ -391,28 +671,30 @@ class CourseLoader(object):
                 if isinstance(v, TextColumnData) and v.typingCorrects:
                     typingCorrects[k] = v.typingCorrects
         for l in learnables:
-            l.identifiers.update(identifiers)
+            l.addIdentifiers(identifiers)
             for k, v in typingCorrects.items():
                 l.columnData[k].typingCorrects = v
 
     def loadCourse(self, courseId):
         course = Course(courseId)
+        course.progress.lazyDates = self.lazyDates
 
         courseData = self.service.loadCourseData(course.id)
 
         course.title = sanitizeName(courseData["title"], "Course")
         course.description = courseData["description"]
         self.levelCount = courseData["num_levels"]
+        course.levelCount = self.levelCount
         self.learnableCount = courseData["num_learnables"]
 
         self.notify('levelCountChanged', self.levelCount)
         self.notify('thingCountChanged', self.learnableCount)
 
-        for levelIndex in range(1,self.levelCount+1):
+        for levelIndex, levelData in self.fetchLevelData(course.id, range(1,self.levelCount+1)):
             try:
-                level = self.loadLevel(course, levelIndex)
+                level = self.loadLevel(course, levelIndex, levelData.result())
                 if level:
-                    course.levels.append(level)
+                    course.addLevel(level)
             except LevelNotFoundError:
                 level = {}
             self.notify('levelLoaded', levelIndex, level)
@@ -420,47 +702,130 @@ class CourseLoader(object):
         for learnables in course.similar_learnables().values():
             if len(learnables) > 1:
                 self.merge_similar_learnables(learnables)
+            # only needed for grouping, a loaded course keeps no fingerprints
+            for learnable in learnables:
+                learnable.fingerprint = None
 
         return course
 
+    def fetchLevelData(self, courseId, levelIndices):
+        # yields (levelIndex, future) in level order, while up to
+        # maxConcurrentLevels requests are in flight in the background
+        if hasattr(self.service, 'submitLevelData'):
+            # the service schedules the requests itself and enforces its own limits
+            futures = collections.OrderedDict()
+            try:
+                for levelIndex in levelIndices:
+                    futures[levelIndex] = self.service.submitLevelData(courseId, levelIndex)
+                for levelIndex, future in futures.items():
+                    yield levelIndex, future
+            finally:
+                for future in futures.values():
+                    future.cancel()
+            return
+
+        if self.maxConcurrentLevels <= 1:
+            for levelIndex in levelIndices:
+                future = concurrent.futures.Future()
+                try:
+                    future.set_result(self.service.loadLevelData(courseId, levelIndex))
+                except LevelNotFoundError as e:
+                    future.set_exception(e)
+                yield levelIndex, future
+            return
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.maxConcurrentLevels) as executor:
+            futures = collections.OrderedDict()
+            try:
+                for levelIndex in levelIndices:
+                    futures[levelIndex] = executor.submit(self.service.loadLevelData, courseId, levelIndex)
+                for levelIndex, future in futures.items():
+                    yield levelIndex, future
+            finally:
+                for future in futures.values():
+                    future.cancel()
+
+    @staticmethod
+    def levelDigest(levelData):
+        hasher = hashlib.blake2b()
+        if orjson is not None:
+            hasher.update(orjson.dumps(levelData, option=orjson.OPT_SORT_KEYS))
+        else:
+            hasher.update(json.dumps(levelData, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode())
+        return hasher.hexdigest()
+
+    def skipLevel(self, course, levelIndex, levelData):
+        # the learnables of an unchanged level are not parsed, but they still
+        # claim their positions, so the numbering of later levels is stable
+        course.skippedLevels.append(levelIndex)
+        for learnableData in levelData["learnables"]:
+            learnableId = learnableData['id']
+            if not course.hasLearnable(learnableId) and not learnableId in course.skippedLearnableIds:
+                course.skippedLearnableIds.add(learnableId)
+                course.getNextPosition()
+            self.notify('thingLoaded', None)
+
     @staticmethod
     def loadProgress(learnable, data):
-        learnable.progress.ignored = data['ignored']
-        learnable.progress.last_date = parse_date(data['last_date'])
-        learnable.progress.created_date = parse_date(data['created_date'])
-        learnable.progress.next_date = parse_date(data['next_date'])
-        learnable.progress.interval = data['interval']
-        learnable.progress.growth_level = data['growth_level']
-        learnable.progress.attempts = data.get('attempts', 0)
-        learnable.progress.correct = data.get('correct', 0)
-        learnable.progress.incorrect = data.get('attempts', 0) - data.get('correct', 0)
-        learnable.progress.total_streak = data['total_streak']
-        learnable.progress.current_streak = data['current_streak']
-        return learnable.progress
-
-    def loadLevel(self, course, levelIndex):
-        levelData = self.service.loadLevelData(course.id, levelIndex)
-        
+        # writes the columns directly, this runs once per learnable of the course
+        progress = learnable.progress
+        table = progress.table
+        row = progress.row
+        columns = table.columns
+        columns['ignored'][row] = bool(data['ignored'])
+        if table.lazyDates:
+            rawDates = table.rawDates
+            rawDates['last_date'][row] = data['last_date']
+            rawDates['created_date'][row] = data['created_date']
+            rawDates['next_date'][row] = data['next_date']
+        else:
+            columns['last_date'][row] = parse_timestamp(data['last_date'])
+            columns['created_date'][row] = parse_timestamp(data['created_date'])
+            columns['next_date'][row] = parse_timestamp(data['next_date'])
+        columns['interval'][row] = toInterval(data['interval'])
+        attempts = toCount(data.get('attempts'))
+        correct = toCount(data.get('correct'))
+        columns['growth_level'][row] = toCount(data['growth_level'])
+        columns['attempts'][row] = attempts
+        columns['correct'][row] = correct
+        columns['incorrect'][row] = attempts - correct
+        columns['total_streak'][row] = toCount(data['total_streak'])
+        columns['current_streak'][row] = toCount(data['current_streak'])
+        return progress
+
+    def loadLevel(self, course, levelIndex, levelData=None):
+        if levelData is None:
+            levelData = self.service.loadLevelData(course.id, levelIndex)
+
         if levelData.get('code') is not None:
             return None
 
+        digest = self.levelDigest(levelData)
+        course.levelDigests[levelIndex] = digest
+        if self.knownLevelDigests.get(levelIndex) == digest:
+            self.skipLevel(course, levelIndex, levelData)
+            return None
+
         level = Level(levelData["session_source_info"]["level_id"])
         level.index = levelData["session_source_info"]["source_sub_index"]
         level.title = sanitizeName(levelData["session_source_info"]["level_name"])
-        level.course = course
 
+        learnables = []
         for learnableData in levelData["learnables"]:
             learnableId = learnableData['id']
+            if learnableId in course.skippedLearnableIds:
+                learnables.append(None)
+                continue
             if course.hasLearnable(learnableId):
                 learnable = course.getLearnable(learnableId)
             else:
-                learnable = Learnable(learnableId)
+                learnable = Learnable(learnableId, course.progress.addProgress())
                 learnable.progress.position = course.getNextPosition()
                 learnable.course = course
                 learnable.level = level
                 for screen in learnableData["screens"].values():
                     if screen['template'] == 'presentation':
-                        learnable.direction = Direction(screen['item']['label'], screen['definition']['label'])
+                        learnable.direction = self.getDirection(screen['item']['label'], screen['definition']['label'])
                         sides = {
                             'source': screen['item']['label'] if screen['item']['direction'] == 'source' else screen['definition']['label'],
                             'target': screen['item']['label'] if screen['item']['direction'] == 'target' else screen['definition']['label']
@@ -477,9 +842,8 @@ class CourseLoader(object):
                             elif col["kind"] == 'text':
                                 data = TextColumnData()
                                 data.values = list(map(str.strip, col['value'].split(",")))
-                                data.alternatives = list(filter(lambda x: x and not x.startswith("_"), col['alternatives']))
-                                data.hiddenAlternatives = list(filter(lambda x: x and x.startswith("_"), col['alternatives']))
-                                data.typingCorrects = []
+                                data.alternatives = list(filter(lambda x: x and not x.startswith("_"), col['alternatives'])) or ()
+                                data.hiddenAlternatives = list(filter(lambda x: x and x.startswith("_"), col['alternatives'])) or ()
                             learnable.setColumnData(column, data)
                         for attr in screen['attributes']:
                             if not attr:
@@ -493,19 +857,67 @@ class CourseLoader(object):
                     elif screen['template'] == 'typing':
                         column = course.getColumn(screen['answer']['label'])
                         if column:
-                            learnable.getColumnData(column, FieldType.Text).typingCorrects = list(filter(lambda x: x != '', screen['correct']))
-                
+                            learnable.getColumnData(column, FieldType.Text).typingCorrects = list(filter(lambda x: x != '', screen['correct'])) or ()
+
+                learnable.updateFingerprint()
                 level.addLearnable(learnable)
 
-            for progressData in levelData["progress"]:
-                learnable = level.getLearnable(int(progressData['learnable_id']))
-                if learnable:
-                    self.loadProgress(learnable, progressData)
+            learnables.append(learnable)
 
+        for progressData in levelData["progress"]:
+            learnable = level.getLearnable(int(progressData['learnable_id']))
+            if learnable:
+                self.loadProgress(learnable, progressData)
+
+        for learnable in learnables:
             self.notify('thingLoaded', learnable)
 
         return level
 
+class MediaDownloader(object):
+    def __init__(self, download, maxWorkers=4, submit=None):
+        # submit, if given, schedules a download itself and returns a future
+        self.download = download
+        self.submit = submit
+        self.executor = None
+        if submit is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=maxWorkers)
+        self.futures = collections.OrderedDict()
+        self.files = {}
+
+    def __len__(self):
+        return len(self.futures)
+
+    def __contains__(self, url):
+        return url in self.futures
+
+    def enqueue(self, downloadableFile):
+        url = downloadableFile.remoteUrl
+        self.files.setdefault(url, []).append(downloadableFile)
+        if not url in self.futures:
+            if self.submit:
+                self.futures[url] = self.submit(url)
+            else:
+                self.futures[url] = self.executor.submit(self.download, url)
+        return self.futures[url]
+
+    def join(self):
+        try:
+            for url, future in self.futures.items():
+                localUrl = future.result()
+                for f in self.files[url]:
+                    f.localUrl = localUrl
+        finally:
+            self.close()
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+        else:
+            for future in self.futures.values():
+                future.cancel()
+            concurrent.futures.wait(list(self.futures.values()))
+
 class MemriseError(RuntimeError):
     pass
 
@@ -515,18 +927,370 @@ class LevelNotFoundError(MemriseError):
 class MemNotFoundError(MemriseError):
     pass
 
+class IncompleteDownloadError(MemriseError):
+    pass
+
+class MediaDownloadError(MemriseError):
+    def __init__(self, status, url=None):
+        super(MediaDownloadError, self).__init__("Media download failed with status {:d}{}".format(status, ": " + url if url else ""))
+        self.status = status
+        self.url = url
+
+class ResponseCache(object):
+    CoursePage = 0
+
+    def __init__(self, filename, ttl=None, maxSize=256*1024*1024):
+        self.ttl = ttl
+        self.maxSize = maxSize
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS responses ("
+                        "course_id INTEGER NOT NULL, level_index INTEGER NOT NULL, "
+                        "data BLOB NOT NULL, size INTEGER NOT NULL, "
+                        "created REAL NOT NULL, accessed REAL NOT NULL, "
+                        "PRIMARY KEY (course_id, level_index))")
+        self.db.commit()
+
+    def get(self, courseId, levelIndex=CoursePage):
+        with self.lock:
+            row = self.db.execute("SELECT data, created FROM responses WHERE course_id=? AND level_index=?", (courseId, levelIndex)).fetchone()
+            if row is None:
+                return None
+            data, created = row
+            now = time.time()
+            if self.ttl is not None and created + self.ttl < now:
+                self.db.execute("DELETE FROM responses WHERE course_id=? AND level_index=?", (courseId, levelIndex))
+                self.db.commit()
+                return None
+            self.db.execute("UPDATE responses SET accessed=? WHERE course_id=? AND level_index=?", (now, courseId, levelIndex))
+            self.db.commit()
+        return zlib.decompress(data).decode('utf-8')
+
+    def set(self, courseId, levelIndex, text):
+        data = zlib.compress(text.encode('utf-8'))
+        now = time.time()
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO responses (course_id, level_index, data, size, created, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                            (courseId, levelIndex, data, len(data), now, now))
+            self.evict()
+            self.db.commit()
+
+    def evict(self):
+        # drops least recently used responses until the cache fits into maxSize
+        if self.maxSize is None:
+            return
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.maxSize:
+            return
+        for courseId, levelIndex, size in self.db.execute("SELECT course_id, level_index, size FROM responses ORDER BY accessed").fetchall():
+            self.db.execute("DELETE FROM responses WHERE course_id=? AND level_index=?", (courseId, levelIndex))
+            total -= size
+            if total <= self.maxSize:
+                break
+
+    def invalidate(self, courseId=None, levelIndex=None):
+        with self.lock:
+            if courseId is None:
+                self.db.execute("DELETE FROM responses")
+            elif levelIndex is None:
+                self.db.execute("DELETE FROM responses WHERE course_id=?", (courseId,))
+            else:
+                self.db.execute("DELETE FROM responses WHERE course_id=? AND level_index=?", (courseId, levelIndex))
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+class MediaStore(object):
+    def __init__(self, filename, contentAddressed=True):
+        # manifest of remote url -> local name, size and digest, kept outside
+        # of the media directory so it isn't reported as an unused file.
+        # It is read once, so existing media is found without touching the
+        # media directory. With contentAddressed files are named after their
+        # digest and the same content served by different urls is kept once.
+        self.contentAddressed = contentAddressed
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS media ("
+                        "url TEXT PRIMARY KEY, name TEXT NOT NULL, "
+                        "size INTEGER NOT NULL, digest TEXT)")
+        self.db.commit()
+        self.entries = {url: (name, size, digest) for url, name, size, digest in self.db.execute("SELECT url, name, size, digest FROM media")}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, url):
+        return url in self.entries
+
+    @staticmethod
+    def hasher():
+        return hashlib.blake2b(digest_size=16)
+
+    @staticmethod
+    def getLocalName(digest, url):
+        contentExtension = os.path.splitext(urllib.parse.urlparse(url).path)[1]
+        return "{:s}{:s}".format(digest, contentExtension)
+
+    def lookup(self, url):
+        entry = self.entries.get(url)
+        return entry[0] if entry else None
+
+    def add(self, url, name, size, digest=None):
+        with self.lock:
+            self.entries[url] = (name, size, digest)
+            self.db.execute("INSERT OR REPLACE INTO media (url, name, size, digest) VALUES (?, ?, ?, ?)", (url, name, size, digest))
+            self.db.commit()
+
+    def remove(self, urls):
+        with self.lock:
+            for url in urls:
+                self.entries.pop(url, None)
+            self.db.executemany("DELETE FROM media WHERE url=?", [(url,) for url in urls])
+            self.db.commit()
+
+    def verify(self, directory, checksums=False, urls=None):
+        # drops entries whose file is missing or differs, so they are downloaded again
+        with self.lock:
+            if urls is None:
+                entries = list(self.entries.items())
+            else:
+                entries = [(url, self.entries[url]) for url in urls if url in self.entries]
+        stale = []
+        for url, (name, size, digest) in entries:
+            fullMediaPath = os.path.join(directory, name)
+            try:
+                if os.path.getsize(fullMediaPath) != size:
+                    stale.append(url)
+                    continue
+                if not checksums:
+                    continue
+                hasher = self.hasher()
+                with open(fullMediaPath, "rb") as mediaFile:
+                    for chunk in iter(lambda: mediaFile.read(1024*1024), b''):
+                        hasher.update(chunk)
+            except OSError:
+                stale.append(url)
+                continue
+            if digest is None:
+                self.add(url, name, size, hasher.hexdigest())
+            elif digest != hasher.hexdigest():
+                stale.append(url)
+        if stale:
+            self.remove(stale)
+        return stale
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+class PartialDownload(object):
+    # a download written to a .part file, which is resumed with a range request
+    # and only moved to its final name once it is complete
+    def __init__(self, path):
+        self.path = path
+        self.offset = os.path.getsize(path) if os.path.isfile(path) else 0
+        self.hasher = MediaStore.hasher()
+        self.size = 0
+        self.expectedSize = None
+        self.file = None
+
+    def requestHeaders(self):
+        # the content must not be decoded, otherwise offsets and sizes don't match
+        headers = {'Accept-Encoding': 'identity'}
+        if self.offset:
+            headers['Range'] = 'bytes={:d}-'.format(self.offset)
+        return headers
+
+    def discard(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+        self.offset = 0
+
+    def begin(self, status, headers, url=None):
+        # error responses are never written, their body isn't the media
+        if status not in (200, 206):
+            self.discard()
+            raise MediaDownloadError(status, url)
+        if status == 206:
+            match = re.match(r'bytes (\d+)-\d+/(\d+|\*)', headers.get('Content-Range', ''))
+            if not match or int(match.group(1)) != self.offset:
+                self.discard()
+                raise IncompleteDownloadError("Unexpected content range: {}".format(headers.get('Content-Range')))
+            with open(self.path, "rb") as partialFile:
+                for chunk in iter(lambda: partialFile.read(1024*1024), b''):
+                    self.hasher.update(chunk)
+            self.size = self.offset
+            if match.group(2) != '*':
+                self.expectedSize = int(match.group(2))
+            self.file = open(self.path, "ab")
+            return self
+
+        # the whole content is sent again
+        self.offset = 0
+        contentLength = headers.get('Content-Length')
+        if contentLength and headers.get('Content-Encoding', 'identity') == 'identity':
+            self.expectedSize = int(contentLength)
+        self.file = open(self.path, "wb")
+        return self
+
+    def write(self, chunk):
+        self.hasher.update(chunk)
+        self.size += len(chunk)
+        self.file.write(chunk)
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def finish(self):
+        # returns size and digest, an incomplete file is kept to be resumed
+        self.close()
+        if self.expectedSize is not None and self.size != self.expectedSize:
+            raise IncompleteDownloadError("Download incomplete: {:d} of {:d} bytes".format(self.size, self.expectedSize))
+        return self.size, self.hasher.hexdigest()
+
+class RateLimiter(object):
+    ThrottleStatus = [429, 503]
+    RetryStatus = [429, 500, 502, 503, 504]
+
+    def __init__(self, rate=None, burst=10, minRate=0.5, maxRate=None, increase=0.5, cooldown=1.0, maxRetries=5, backoff=1.0, retryBudget=0.2, minRetries=10):
+        # rate None means unlimited until the server pushes back for the first time
+        self.rate = rate
+        self.burst = burst
+        self.minRate = minRate
+        self.maxRate = maxRate
+        self.increase = increase
+        self.cooldown = cooldown
+        self.maxRetries = maxRetries
+        self.backoff = backoff
+        self.retryBudget = retryBudget
+        self.minRetries = minRetries
+        self.lock = threading.Lock()
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blockedUntil = 0.0
+        self.throttledAt = None
+        self.recent = collections.deque(maxlen=1000)
+        self.counters = collections.Counter()
+        self.latency = 0.0
+        self.maxLatency = 0.0
+
+    def reserve(self):
+        # takes a token and returns how long to wait before using it
+        with self.lock:
+            now = time.monotonic()
+            self.recent.append(now)
+            self.counters['requests'] += 1
+            delay = max(0.0, self.blockedUntil - now)
+            if self.rate is not None:
+                self.tokens = min(float(self.burst), self.tokens + (now - self.updated) * self.rate)
+                self.tokens -= 1.0
+                if self.tokens < 0:
+                    delay = max(delay, -self.tokens / self.rate)
+            self.updated = now
+            if delay > 0:
+                self.counters['delayed'] += 1
+            return delay
+
+    def observedRate(self):
+        now = time.monotonic()
+        return float(sum(1 for t in self.recent if now - t <= 1.0))
+
+    @staticmethod
+    def parseRetryAfter(value):
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            date = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(0.0, (date - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+    def complete(self, status, retryAfter=None, latency=0.0, attempt=0):
+        # records a finished request and returns the delay before retrying it, or None
+        with self.lock:
+            self.counters['completed'] += 1
+            self.latency += latency
+            self.maxLatency = max(self.maxLatency, latency)
+            retryAfter = self.parseRetryAfter(retryAfter)
+            if status in self.ThrottleStatus:
+                self.counters['throttled'] += 1
+                now = time.monotonic()
+                # requests in flight get rejected together, slow down once per cooldown
+                if self.throttledAt is None or now - self.throttledAt >= self.cooldown:
+                    self.throttledAt = now
+                    self.rate = max(self.minRate, (self.rate or self.observedRate()) / 2.0)
+                    self.tokens = min(self.tokens, 0.0)
+                if retryAfter:
+                    self.blockedUntil = max(self.blockedUntil, time.monotonic() + retryAfter)
+            elif status < 400 and self.rate is not None:
+                self.rate += self.increase
+                if self.maxRate is not None:
+                    self.rate = min(self.maxRate, self.rate)
+
+            if not status in self.RetryStatus:
+                return None
+            if attempt >= self.maxRetries or self.counters['retries'] >= self.minRetries + self.retryBudget * self.counters['requests']:
+                self.counters['failed'] += 1
+                return None
+            self.counters['retries'] += 1
+            return max(retryAfter or 0.0, self.backoff * (2 ** attempt))
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            completed = stats.get('completed', 0)
+            stats['rate'] = self.rate
+            stats['latency_avg'] = self.latency / completed if completed else 0.0
+            stats['latency_max'] = self.maxLatency
+            return stats
+
 class Service(object):
-    def __init__(self, downloadDirectory=None, cookiejar=None):
+    def __init__(self, downloadDirectory=None, cookiejar=None, responseCache=None, rateLimiter=None, mediaStore=None, mediaChunkSize=256*1024, partialDirectory=None):
         self.downloadDirectory = downloadDirectory
+        # incomplete downloads are kept next to the media directory, not in it
+        self.partialDirectory = partialDirectory
+        self.mediaChunkSize = mediaChunkSize
+        self.responseCache = responseCache
+        self.mediaStore = mediaStore
+        # checks the file of every url found in the media store
+        self.verifyExistingMedia = False
+        if rateLimiter is None:
+            rateLimiter = RateLimiter()
+        self.rateLimiter = rateLimiter
         if cookiejar is None:
             cookiejar = http.cookiejar.CookieJar()
         self.session = requests.Session()
         self.session.cookies = cookiejar
-        retry_strategy = Retry(total=5, backoff_factor=1.0)
+        # 429 and 503 with Retry-After are left to the rate limiter
+        retry_strategy = Retry(total=5, backoff_factor=1.0, respect_retry_after_header=False)
         adapter =  requests.adapters.HTTPAdapter(max_retries=retry_strategy)
         self.session.mount("https://", adapter)
         self.session.mount("http://", adapter)
 
+    def request(self, method, url, **kwargs):
+        attempt = 0
+        while True:
+            time.sleep(self.rateLimiter.reserve())
+            start = time.monotonic()
+            response = self.session.request(method, url, **kwargs)
+            delay = self.rateLimiter.complete(response.status_code, response.headers.get('Retry-After'), time.monotonic() - start, attempt)
+            if delay is None:
+                return response
+            response.close()
+            attempt += 1
+            time.sleep(delay)
+
     def getCookie(self, name):
         cookies = requests.utils.dict_from_cookiejar(self.session.cookies)
         return cookies.get(name)
@@ -566,16 +1330,119 @@ class Service(object):
 
         return True
 
-    def loadCourse(self, url, observer=None):
-        courseLoader = CourseLoader(self)
+    def loadCourse(self, url, observer=None, maxConcurrentLevels=1, knownLevelDigests=None, lazyDates=False):
+        courseLoader = CourseLoader(self, maxConcurrentLevels, knownLevelDigests, lazyDates)
         if not observer is None:
             courseLoader.registerObserver(observer)
         return courseLoader.loadCourse(self.getCourseIdFromUrl(url))
 
-    def loadCourseData(self, courseId):
+    def loadCourseHtml(self, courseId):
+        if self.responseCache:
+            text = self.responseCache.get(courseId, ResponseCache.CoursePage)
+            if text is not None:
+                return text
+
         courseUrl = self.getHtmlCourseUrl(courseId)
-        response = self.session.get(courseUrl)
-        soup = bs4.BeautifulSoup(response.text, 'html.parser')
+        response = self.request('GET', courseUrl)
+        if self.responseCache and response.ok:
+            self.responseCache.set(courseId, ResponseCache.CoursePage, response.text)
+        return response.text
+
+    def loadCourseData(self, courseId):
+        return self.parseCourseData(self.loadCourseHtml(courseId))
+
+    CourseTagPattern = re.compile(r'<!--.*?-->|<(script|style)\b[^>]*>[^<]*(?:<(?!/\1\s*>)[^<]*)*</\1\s*>|<(/?)(h1|span|div)\b([^>]*)>', re.S | re.I)
+    ClassPattern = re.compile(r'''\bclass\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))''', re.I)
+    EndTagPattern = re.compile(r'</(\w+)\s*>')
+
+    @staticmethod
+    def getTagString(html, pos, tag):
+        # text of an element without child elements, like Tag.string
+        end = html.find('<', pos)
+        match = Service.EndTagPattern.match(html, end) if end >= 0 else None
+        if not match or match.group(1).lower() != tag:
+            raise ValueError("element has children")
+        return htmlmodule.unescape(html[pos:end]) or None
+
+    @staticmethod
+    def extractCourseData(html):
+        # scans only the tags parseCourseDataWithSoup looks at and stops after the
+        # level list, returns None if the page isn't laid out as expected
+        data = {
+            'title': None,
+            'description': None,
+            'num_levels': 0,
+            'num_learnables': None,
+        }
+        foundDescription = False
+        levelsDepth = 0
+        levelsFound = False
+        thingsFound = False
+        levelNums = []
+
+        try:
+            for match in Service.CourseTagPattern.finditer(html):
+                tag = match.group(3)
+                if not tag:
+                    continue
+                tag = tag.lower()
+                if match.group(2):
+                    if tag == 'div' and levelsDepth:
+                        levelsDepth -= 1
+                        if not levelsDepth and data['title'] is not None and foundDescription and data['num_learnables'] is not None:
+                            break
+                    continue
+
+                if tag == 'div' and levelsDepth:
+                    levelsDepth += 1
+                attrs = Service.ClassPattern.search(match.group(4))
+                classes = next(filter(None, attrs.groups()), '').split() if attrs else []
+
+                if tag == 'h1' and 'course-name' in classes and data['title'] is None:
+                    data['title'] = Service.getTagString(html, match.end(), tag)
+                elif tag == 'span' and 'course-description' in classes and not foundDescription:
+                    data['description'] = Service.getTagString(html, match.end(), tag)
+                    foundDescription = True
+                elif tag == 'div' and 'progress-box-title' in classes and data['num_learnables'] is None:
+                    found = re.match(r'[^<]*', html[match.end():]).group(0)
+                    if not found:
+                        raise ValueError("first child is an element")
+                    found = re.search(r'([0-9]+)\s*/\s*([0-9]+)', htmlmodule.unescape(found))
+                    data['num_learnables'] = int(found.group(2)) if found else 0
+                elif tag == 'div' and 'level-index' in classes:
+                    levelNums.append(int(Service.getTagString(html, match.end(), tag)))
+                elif tag == 'div' and 'levels' in classes and not levelsFound:
+                    levelsFound = True
+                    levelsDepth = 1
+                elif tag == 'div' and 'things' in classes:
+                    thingsFound = True
+        except (ValueError, TypeError):
+            return None
+
+        if data['title'] is None:
+            return None
+        if levelsFound and levelNums:
+            data['num_levels'] = max(levelNums)
+        elif not levelsFound and thingsFound:
+            data['num_levels'] = 1
+        else:
+            return None
+        if not foundDescription:
+            data['description'] = ''
+        if data['num_learnables'] is None:
+            data['num_learnables'] = 0
+        return data
+
+    @staticmethod
+    def parseCourseData(html):
+        data = Service.extractCourseData(html)
+        if data is None:
+            data = Service.parseCourseDataWithSoup(html)
+        return data
+
+    @staticmethod
+    def parseCourseDataWithSoup(html):
+        soup = bs4.BeautifulSoup(html, 'html.parser')
 
         data = {
             'title': '',
@@ -614,24 +1481,61 @@ class Service(object):
         return data
 
     def loadLevelData(self, courseId, levelIndex):
+        if self.responseCache:
+            text = self.responseCache.get(courseId, levelIndex)
+            if text is not None:
+                return self.parseLevelData(text)
+
         try:
-            level_data = {
-                'session_source_id': courseId,
-                'session_source_sub_index': levelIndex,
-                'session_source_type': 'course_id_and_level_index'
-            }
-            headers = {
-                'X-CSRFToken': self.getCookie('csrftoken'),
-                'Referer': self.getHtmlLevelUrl(courseId, levelIndex)
-            }
-            response = self.session.post(self.getJsonLevelUrl(), json=level_data, headers=headers)
-            return response.json()
+            level_data = self.getLevelRequestData(courseId, levelIndex)
+            headers = self.getLevelRequestHeaders(courseId, levelIndex)
+            response = self.request('POST', self.getJsonLevelUrl(), json=level_data, headers=headers)
+            data = self.parseLevelData(response.content)
+            if self.responseCache and response.ok and data.get('code') is None:
+                self.responseCache.set(courseId, levelIndex, response.text)
+            return data
         except urllib.error.HTTPError as e:
             if e.code == 404 or e.code == 400:
                 raise LevelNotFoundError("Level not found: {}".format(levelIndex))
             else:
                 raise
 
+    @staticmethod
+    def pruneScreens(obj):
+        # object hook for the level json, screens are the only objects with a template
+        template = obj.get('template')
+        if template is not None and template not in CourseLoader.ScreenTemplates:
+            return None
+        screens = obj.get('screens')
+        if isinstance(screens, dict):
+            obj['screens'] = {k: v for k, v in screens.items() if v is not None}
+        return obj
+
+    @staticmethod
+    def parseLevelData(text):
+        # unused screens are dropped while decoding, so they are freed right away
+        # instead of being kept and serialised for the level digest
+        if orjson is None:
+            return json.loads(text, object_hook=Service.pruneScreens)
+        data = orjson.loads(text)
+        for learnableData in data.get('learnables', ()):
+            learnableData['screens'] = {k: v for k, v in learnableData['screens'].items() if v.get('template') in CourseLoader.ScreenTemplates}
+        return data
+
+    @staticmethod
+    def getLevelRequestData(courseId, levelIndex):
+        return {
+            'session_source_id': courseId,
+            'session_source_sub_index': levelIndex,
+            'session_source_type': 'course_id_and_level_index'
+        }
+
+    def getLevelRequestHeaders(self, courseId, levelIndex):
+        return {
+            'X-CSRFToken': self.getCookie('csrftoken'),
+            'Referer': self.getHtmlLevelUrl(courseId, levelIndex)
+        }
+
     @staticmethod
     def getCourseIdFromUrl(url):
         match = re.match(r'https://community-courses.memrise.com/community/course/(\d+)/.+/', url)
@@ -664,23 +1568,76 @@ class Service(object):
         url = re.sub(r"^\/static\/", "/", url)
         return urllib.parse.urljoin("http://static.memrise.com/", url)
 
+    @staticmethod
+    def getLocalMediaName(url):
+        memrisePath = urllib.parse.urlparse(url).path
+        contentExtension = os.path.splitext(memrisePath)[1]
+        return "{:s}{:s}".format(str(uuid.uuid5(uuid.NAMESPACE_URL, url)), contentExtension)
+
+    def getPartialMediaPath(self, url):
+        partialDirectory = self.partialDirectory or os.path.normpath(self.downloadDirectory) + '.partial'
+        os.makedirs(partialDirectory, exist_ok=True)
+        return os.path.join(partialDirectory, self.getLocalMediaName(url) + '.part')
+
+    def placeMedia(self, partialPath, url, size, digest):
+        # moves a complete download to its final name, which is never seen incomplete
+        if self.mediaStore is not None and self.mediaStore.contentAddressed:
+            localName = self.mediaStore.getLocalName(digest, url)
+            fullMediaPath = os.path.join(self.downloadDirectory, localName)
+            if os.path.isfile(fullMediaPath) and os.path.getsize(fullMediaPath) == size:
+                os.remove(partialPath)
+                return localName
+        else:
+            localName = self.getLocalMediaName(url)
+            fullMediaPath = os.path.join(self.downloadDirectory, localName)
+        os.replace(partialPath, fullMediaPath)
+        return localName
+
+    def findExistingMedia(self, url):
+        if self.mediaStore is not None:
+            localName = self.mediaStore.lookup(url)
+            if localName and not (self.verifyExistingMedia and self.mediaStore.verify(self.downloadDirectory, urls=[url])):
+                return localName
+
+        # files downloaded before there was a manifest are adopted into it
+        localName = self.getLocalMediaName(url)
+        fullMediaPath = os.path.join(self.downloadDirectory, localName)
+        if os.path.isfile(fullMediaPath) and os.path.getsize(fullMediaPath) > 0:
+            if self.mediaStore is not None:
+                self.mediaStore.add(url, localName, os.path.getsize(fullMediaPath))
+            return localName
+
+        return None
+
     def downloadMedia(self, url, skipExisting=False):
         if not self.downloadDirectory:
             return url
 
+        if skipExisting:
+            localName = self.findExistingMedia(url)
+            if localName:
+                return localName
+
         # Replace links to images and audio on the Memrise servers
         # by downloading the content to the user's media dir
-        memrisePath = urllib.parse.urlparse(url).path
-        contentExtension = os.path.splitext(memrisePath)[1]
-        localName = "{:s}{:s}".format(str(uuid.uuid5(uuid.NAMESPACE_URL, url)), contentExtension)
-        fullMediaPath = os.path.join(self.downloadDirectory, localName)
-
-        if skipExisting and os.path.isfile(fullMediaPath) and os.path.getsize(fullMediaPath) > 0:
-            return localName
-
-        response = self.session.get(url, stream=True)
-        with open(fullMediaPath, "wb") as mediaFile:
-            for chunk in response.iter_content(chunk_size=1024):
-                mediaFile.write(chunk)
+        partial = PartialDownload(self.getPartialMediaPath(url))
+        response = self.request('GET', url, stream=True, headers=partial.requestHeaders())
+        if response.status_code == 416:
+            response.close()
+            partial.discard()
+            response = self.request('GET', url, stream=True, headers=partial.requestHeaders())
+
+        with response:
+            partial.begin(response.status_code, response.headers, url)
+            try:
+                for chunk in response.iter_content(chunk_size=self.mediaChunkSize):
+                    partial.write(chunk)
+            finally:
+                partial.close()
+        size, digest = partial.finish()
+
+        localName = self.placeMedia(partial.path, url, size, digest)
+        if self.mediaStore is not None:
+            self.mediaStore.add(url, localName, size, digest)
 
         return localName
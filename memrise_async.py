@@ -0,0 +1,209 @@
+import asyncio, functools, threading, time, urllib.parse
+
+try:
+    from . import memrise
+except ImportError:
+    import memrise
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import h2
+except ImportError:
+    h2 = None
+
+class AsyncService(object):
+    def __init__(self, service, maxConnections=32, maxConnectionsPerHost=8, retries=5, http2=True, transport=None):
+        # without httpx the requests of the wrapped service are run in the default executor
+        self.service = service
+        self.maxConnections = maxConnections
+        self.maxConnectionsPerHost = maxConnectionsPerHost
+        self.retries = retries
+        self.http2 = http2 and h2 is not None
+        self.transport = transport
+        self.client = None
+        self.hostLimits = {}
+
+    async def open(self):
+        if self.client is None and httpx is not None:
+            transport = self.transport
+            if transport is None:
+                limits = httpx.Limits(max_connections=self.maxConnections, max_keepalive_connections=self.maxConnections)
+                transport = httpx.AsyncHTTPTransport(retries=self.retries, http2=self.http2, limits=limits)
+            self.client = httpx.AsyncClient(transport=transport, cookies=self.service.session.cookies, follow_redirects=True)
+        return self
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def hostLimit(self, url):
+        host = urllib.parse.urlparse(url).netloc
+        if not host in self.hostLimits:
+            self.hostLimits[host] = asyncio.Semaphore(self.maxConnectionsPerHost)
+        return self.hostLimits[host]
+
+    async def runBlocking(self, func, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+    async def request(self, method, url, **kwargs):
+        if self.client is None:
+            async with self.hostLimit(url):
+                response = await self.runBlocking(self.service.request, method, url, **kwargs)
+                return response.ok, response.text
+
+        rateLimiter = self.service.rateLimiter
+        attempt = 0
+        while True:
+            await asyncio.sleep(rateLimiter.reserve())
+            async with self.hostLimit(url):
+                start = time.monotonic()
+                response = await self.client.request(method, url, **kwargs)
+                delay = rateLimiter.complete(response.status_code, response.headers.get('Retry-After'), time.monotonic() - start, attempt)
+            if delay is None:
+                return response.is_success, response.text
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def loadCourseHtml(self, courseId):
+        responseCache = self.service.responseCache
+        if responseCache:
+            text = responseCache.get(courseId, memrise.ResponseCache.CoursePage)
+            if text is not None:
+                return text
+
+        ok, text = await self.request('GET', self.service.getHtmlCourseUrl(courseId))
+        if responseCache and ok:
+            responseCache.set(courseId, memrise.ResponseCache.CoursePage, text)
+        return text
+
+    async def loadCourseData(self, courseId):
+        return self.service.parseCourseData(await self.loadCourseHtml(courseId))
+
+    async def loadLevelData(self, courseId, levelIndex):
+        responseCache = self.service.responseCache
+        if responseCache:
+            text = responseCache.get(courseId, levelIndex)
+            if text is not None:
+                return self.service.parseLevelData(text)
+
+        # requests drops headers set to None, httpx refuses them
+        headers = {k: v for k, v in self.service.getLevelRequestHeaders(courseId, levelIndex).items() if v is not None}
+        ok, text = await self.request('POST', self.service.getJsonLevelUrl(),
+                                      json=self.service.getLevelRequestData(courseId, levelIndex), headers=headers)
+        data = self.service.parseLevelData(text)
+        if responseCache and ok and data.get('code') is None:
+            responseCache.set(courseId, levelIndex, text)
+        return data
+
+    async def downloadMedia(self, url, skipExisting=False):
+        if self.client is None:
+            async with self.hostLimit(url):
+                return await self.runBlocking(self.service.downloadMedia, url, skipExisting=skipExisting)
+
+        if not self.service.downloadDirectory:
+            return url
+
+        # file system and media store work runs in the executor, so it
+        # doesn't hold up the other requests on the event loop
+        if skipExisting:
+            localName = await self.runBlocking(self.service.findExistingMedia, url)
+            if localName:
+                return localName
+
+        partial = await self.runBlocking(lambda: memrise.PartialDownload(self.service.getPartialMediaPath(url)))
+        rateLimiter = self.service.rateLimiter
+        attempt = 0
+        while True:
+            await asyncio.sleep(rateLimiter.reserve())
+            async with self.hostLimit(url):
+                start = time.monotonic()
+                async with self.client.stream('GET', url, headers=partial.requestHeaders()) as response:
+                    delay = rateLimiter.complete(response.status_code, response.headers.get('Retry-After'), time.monotonic() - start, attempt)
+                    if delay is None and response.status_code == 416:
+                        await self.runBlocking(partial.discard)
+                        delay = 0
+                    elif delay is None:
+                        await self.runBlocking(partial.begin, response.status_code, response.headers, url)
+                        try:
+                            async for chunk in response.aiter_bytes(chunk_size=self.service.mediaChunkSize):
+                                await self.runBlocking(partial.write, chunk)
+                        finally:
+                            await self.runBlocking(partial.close)
+                        break
+            attempt += 1
+            await asyncio.sleep(delay)
+
+        return await self.runBlocking(self.placeMedia, partial, url)
+
+    def placeMedia(self, partial, url):
+        size, digest = partial.finish()
+        localName = self.service.placeMedia(partial.path, url, size, digest)
+        if self.service.mediaStore is not None:
+            self.service.mediaStore.add(url, localName, size, digest)
+        return localName
+
+class SyncFacade(object):
+    # runs an AsyncService on its own event loop thread and offers the
+    # blocking interface of memrise.Service, plus future based submit methods
+    # which CourseLoader and MediaDownloader use to keep many requests in flight
+    def __init__(self, asyncService):
+        self.asyncService = asyncService
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.run(self.asyncService.open())
+
+    def __getattr__(self, attr):
+        return getattr(self.asyncService.service, attr)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro):
+        return self.submit(coro).result()
+
+    def submitLevelData(self, courseId, levelIndex):
+        return self.submit(self.asyncService.loadLevelData(courseId, levelIndex))
+
+    def submitDownloadMedia(self, url, skipExisting=False):
+        return self.submit(self.asyncService.downloadMedia(url, skipExisting=skipExisting))
+
+    def loadCourseData(self, courseId):
+        return self.run(self.asyncService.loadCourseData(courseId))
+
+    def loadLevelData(self, courseId, levelIndex):
+        return self.run(self.asyncService.loadLevelData(courseId, levelIndex))
+
+    def downloadMedia(self, url, skipExisting=False):
+        return self.run(self.asyncService.downloadMedia(url, skipExisting=skipExisting))
+
+    def loadCourse(self, url, observer=None, maxConcurrentLevels=1, knownLevelDigests=None, lazyDates=False):
+        courseLoader = memrise.CourseLoader(self, maxConcurrentLevels, knownLevelDigests, lazyDates)
+        if not observer is None:
+            courseLoader.registerObserver(observer)
+        return courseLoader.loadCourse(self.getCourseIdFromUrl(url))
+
+    def close(self):
+        if self.loop.is_closed():
+            return
+        self.run(self.asyncService.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
@@ -1,5 +1,9 @@
-import re, copy
-from . import mistune
+import collections, copy, html, itertools, re, threading
+
+try:
+    from . import memrise, mistune
+except ImportError:
+    import memrise, mistune
 
 class MemriseRenderer(mistune.Renderer):
     def __init__(self, capture_images=None, *args, **kwargs):
@@ -28,6 +32,7 @@ class MemriseInlineLexer(mistune.InlineLexer):
     default_rules = copy.copy(mistune.InlineLexer.default_rules)
     default_rules.insert(0, 'memrise_image')
     default_rules.insert(1, 'memrise_embed')
+    combine_rules = True
 
     def __init__(self, renderer, rules=None, **kwargs):
         if rules is None:
@@ -46,10 +51,162 @@ class MemriseInlineLexer(mistune.InlineLexer):
 def Markdown(image_urls=None, **kwargs):
     return mistune.Markdown(renderer=MemriseRenderer(capture_images=image_urls), inline=MemriseInlineLexer, **kwargs)
 
+class Converter(object):
+    # a long-lived Markdown instance which is reset before every document,
+    # with an LRU memo of the rendered values, since course fields repeat a lot
+    def __init__(self, cacheSize=4096, use_xhtml=True, escape=False, **kwargs):
+        # escape renders raw html in the text as text
+        self.renderer = MemriseRenderer(escape=True) if escape else MemriseRenderer()
+        self.markdown = mistune.Markdown(renderer=self.renderer, inline=MemriseInlineLexer, use_xhtml=use_xhtml, **kwargs)
+        self.cacheSize = cacheSize
+        self.cache = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def reset(self):
+        block = self.markdown.block
+        block.tokens = []
+        block.def_links = {}
+        block.def_footnotes = {}
+        block._list_depth = 0
+        block._blockquote_depth = 0
+        inline = self.markdown.inline
+        inline.setup(None, None)
+        inline._in_link = False
+        inline._in_footnote = False
+        self.markdown.tokens = []
+        self.markdown.footnotes = []
+
+    def render(self, text):
+        # returns the html and a tuple of the image urls in the text
+        with self.lock:
+            result = self.cache.get(text)
+            if result is not None:
+                self.cache.move_to_end(text)
+                return result
+
+            images = []
+            self.reset()
+            self.renderer.capture_images = images
+            try:
+                result = self.markdown(text), tuple(images)
+            finally:
+                self.renderer.capture_images = None
+
+            if self.cacheSize > 0:
+                self.cache[text] = result
+                if len(self.cache) > self.cacheSize:
+                    self.cache.popitem(last=False)
+            return result
+
+    def convert(self, text, image_urls=None):
+        output, images = self.render(text)
+        if not image_urls is None:
+            image_urls.extend(images)
+        return output
+
+    def convert_many(self, texts, image_urls=None):
+        return [self.convert(text, image_urls) for text in texts]
+
+    def convertAndReturnImages(self, text):
+        output, images = self.render(text)
+        return output, list(images)
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+
+converters = {}
+convertersLock = threading.Lock()
+
+def getConverter(use_xhtml=True, **kwargs):
+    # one shared converter per set of options
+    key = (use_xhtml,) + tuple(sorted(kwargs.items()))
+    with convertersLock:
+        converter = converters.get(key)
+        if converter is None:
+            converter = converters[key] = Converter(use_xhtml=use_xhtml, **kwargs)
+        return converter
+
 def convert(text, image_urls=None, use_xhtml=True, **kwargs):
-    return Markdown(image_urls, use_xhtml=use_xhtml, **kwargs)(text)
+    return getConverter(use_xhtml, **kwargs).convert(text, image_urls)
+
+def convert_many(texts, image_urls=None, use_xhtml=True, **kwargs):
+    return getConverter(use_xhtml, **kwargs).convert_many(texts, image_urls)
 
 def convertAndReturnImages(text, **kwargs):
-    image_urls = []
-    output = convert(text, image_urls=image_urls, **kwargs)
-    return output, image_urls
+    return getConverter(**kwargs).convertAndReturnImages(text)
+
+class MarkdownMedia(object):
+    # renders text values as markdown and keeps the images in them as
+    # DownloadableFiles, which go through the same MediaDownloader as the
+    # media columns; render rewrites the images to their local names
+    ImagePattern = re.compile(r'(<img src=")([^"]*)(")')
+    ParagraphPattern = re.compile(r'^<p>((?:(?!</?p>)[\s\S])*)</p>\n?$')
+
+    def __init__(self, converter=None, toAbsoluteUrl=None):
+        # html in field values is text, as it was before they were rendered
+        self.converter = converter or Converter(escape=True)
+        self.toAbsoluteUrl = toAbsoluteUrl or (lambda url: url)
+        self.files = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.files)
+
+    def collect(self, text):
+        # returns the files of the images in text which weren't seen before
+        output, images = self.converter.render(text.strip())
+        new = []
+        with self.lock:
+            for src in images:
+                url = self.toAbsoluteUrl(src)
+                if url and not url in self.files:
+                    self.files[url] = memrise.DownloadableFile(url)
+                    new.append(self.files[url])
+        return new
+
+    @staticmethod
+    def learnableTexts(learnable):
+        for colName in learnable.course.getColumnNames(memrise.FieldType.Text):
+            data = learnable.getColumnData(colName, memrise.FieldType.Text)
+            for text in itertools.chain(data.values, data.alternatives, data.hiddenAlternatives, data.typingCorrects):
+                yield text
+        # attributes are text fields too and are rendered the same way
+        for data in learnable.attributeData.values():
+            for text in data.values:
+                yield text
+
+    def collectLearnable(self, learnable):
+        new = []
+        for text in self.learnableTexts(learnable):
+            new.extend(self.collect(text))
+        return new
+
+    def getLearnableFiles(self, learnable):
+        # the collected files of the images in the text values of learnable
+        files = []
+        for text in self.learnableTexts(learnable):
+            output, images = self.converter.render(text.strip())
+            files.extend(self.files[url] for url in map(self.toAbsoluteUrl, images) if url in self.files)
+        return files
+
+    def getFiles(self):
+        return list(self.files.values())
+
+    def getUrl(self, src):
+        url = self.toAbsoluteUrl(src)
+        media = self.files.get(url)
+        if media is not None and media.isDownloaded():
+            return media.localUrl
+        return url
+
+    def rewriteImages(self, output):
+        return self.ImagePattern.sub(lambda m: m.group(1) + mistune.escape_link(self.getUrl(html.unescape(m.group(2)))) + m.group(3), output)
+
+    def render(self, text):
+        # a single paragraph is unwrapped, fields are inline content
+        output = self.rewriteImages(self.converter.convert(text.strip())).strip()
+        match = self.ParagraphPattern.match(output)
+        if match:
+            return match.group(1)
+        return output
@@ -52,6 +52,315 @@ def _keyify(key):
     return _key_pattern.sub(' ', key)
 
 
+# states of a position in a pattern relative to the position the match
+# starts at: surely there, maybe there (after optional atoms), or past it
+_AT_START, _MAYBE_AT_START, _PAST_START = 0, 1, 2
+_position_patterns = {}
+_shared_scanners = {}
+_backreference_pattern = re.compile(r'\\([1-9][0-9]?)(?![0-7])')
+_quantifier_pattern = re.compile(r'\{(\d*)(?:,(\d*))?\}')
+
+
+def _join_states(a, b):
+    return a if a == b else _MAYBE_AT_START
+
+
+class _SlicedPattern(object):
+    """Matches a pattern against a copy of the remaining text, like the
+    lexers used to do, for patterns which can't be matched in place."""
+
+    def __init__(self, regex):
+        self.regex = regex
+
+    def match(self, text, pos=0):
+        return self.regex.match(text[pos:])
+
+
+def _position_pattern(regex):
+    r"""Return a pattern whose ``match(text, pos)`` matches like
+    ``regex.match(text[pos:])`` does, without copying the text.
+
+    ``^``, ``\A`` and ``\b`` only see the start of the remaining text when
+    it is sliced off, so where they can only apply at the match position
+    they are rewritten into assertions which don't look behind it.
+    """
+    # keyed by id, hashing a compiled pattern hashes its whole source
+    entry = _position_patterns.get(id(regex))
+    if entry is None or entry[0] is not regex:
+        source = _rewrite_position_pattern(regex)
+        if source is None:
+            pattern = _SlicedPattern(regex)
+        else:
+            pattern = re.compile(source, regex.flags)
+        entry = _position_patterns[id(regex)] = (regex, pattern)
+    return entry[1]
+
+
+def _scanners(lexer, rules, prefix):
+    """Return the position patterns and handler functions of ``rules``.
+
+    They are shared by all lexers of a class unless the grammar instance
+    has patterns of its own, like a hard wrap grammar.
+    """
+    grammar = lexer.rules
+    key = (type(lexer), type(grammar), tuple(rules), prefix)
+    cache = _shared_scanners if not vars(grammar) else lexer._scanners
+    scanners = cache.get(key)
+    if scanners is None:
+        scanners = cache[key] = [
+            (_position_pattern(getattr(grammar, name)),
+             getattr(type(lexer), prefix + name))
+            for name in rules
+        ]
+    return scanners
+
+
+class _RuleMatch(object):
+    """The match of one rule inside a match of the combined rules, with
+    the group numbers of the rule's own pattern."""
+
+    __slots__ = ('_match', '_offset', '_size')
+
+    def __init__(self, match, offset, size):
+        self._match = match
+        self._offset = offset
+        self._size = size
+
+    def group(self, *groups):
+        if len(groups) == 1:
+            return self._match.group(groups[0] + self._offset)
+        if not groups:
+            return self._match.group(self._offset)
+        return tuple(self._match.group(g + self._offset) for g in groups)
+
+    def groups(self, default=None):
+        return tuple(
+            default if value is None else value
+            for value in self._match.groups()[
+                self._offset:self._offset + self._size]
+        )
+
+    def start(self, group=0):
+        return self._match.start(group + self._offset)
+
+    def end(self, group=0):
+        return self._match.end(group + self._offset)
+
+    def span(self, group=0):
+        return self._match.span(group + self._offset)
+
+
+def _combined_scanner(lexer, rules):
+    """Return one pattern matching the alternation of ``rules`` and a
+    dict from the group number of every alternative to its rule index and
+    group count, or None if the patterns can't be combined.
+
+    The first alternative matching at a position is the rule which
+    would match first when trying them in turn, so every step takes one
+    match instead of one per rule.
+    """
+    grammar = lexer.rules
+    key = (type(lexer), type(grammar), tuple(rules), None)
+    cache = _shared_scanners if not vars(grammar) else lexer._scanners
+    if key not in cache:
+        cache[key] = _combine_patterns(
+            [getattr(grammar, name) for name in rules])
+    return cache[key]
+
+
+def _combine_patterns(regexes):
+    sources = []
+    alternatives = {}
+    offset = 1
+    for index, regex in enumerate(regexes):
+        source = _rewrite_position_pattern(regex)
+        if source is None or regex.groupindex or regex.flags != regexes[0].flags:
+            return None
+        sources.append('(%s)' % _renumber_groups(source, offset))
+        alternatives[offset] = (index, regex.groups)
+        offset += regex.groups + 1
+    return re.compile('|'.join(sources), regexes[0].flags), alternatives
+
+
+def _renumber_groups(source, offset):
+    # shift back references and conditions by the groups in front
+    out = []
+    i = 0
+    length = len(source)
+    while i < length:
+        c = source[i]
+        if c == '[':
+            j = i + 1
+            if source[j:j + 1] == '^':
+                j += 1
+            if source[j:j + 1] == ']':
+                j += 1
+            while j < length and source[j] != ']':
+                j += 2 if source[j] == '\\' else 1
+            out.append(source[i:j + 1])
+            i = j + 1
+        elif c == '\\':
+            m = _backreference_pattern.match(source, i)
+            if m:
+                out.append('(?:\\%d)' % (int(m.group(1)) + offset))
+                i = m.end()
+            else:
+                out.append(source[i:i + 2])
+                i += 2
+        elif source.startswith('(?(', i):
+            j = source.index(')', i)
+            group = source[i + 3:j]
+            if group.isdigit():
+                group = str(int(group) + offset)
+            out.append('(?(%s)' % group)
+            i = j + 1
+        else:
+            out.append(c)
+            i += 1
+    return ''.join(out)
+
+
+def _rewrite_position_pattern(regex):
+    source = regex.pattern
+    if not isinstance(source, str) or regex.flags & re.X:
+        return None
+
+    out = []
+    # one entry per open group: [state at its start, joined end states
+    # of its finished alternatives, kind of group]
+    groups = []
+    state = _AT_START
+    before = state  # state before the last atom, for optional quantifiers
+    quantified = False
+    i = 0
+    length = len(source)
+    while i < length:
+        c = source[i]
+        after_quantifier, quantified = quantified, False
+        if c == '[':
+            j = i + 1
+            if source[j:j + 1] == '^':
+                j += 1
+            if source[j:j + 1] == ']':
+                j += 1
+            while j < length and source[j] != ']':
+                j += 2 if source[j] == '\\' else 1
+            out.append(source[i:j + 1])
+            before, state = state, _PAST_START
+            i = j + 1
+        elif c == '\\':
+            token = source[i:i + 2]
+            i += 2
+            if token in ('\\b', '\\B', '\\A'):
+                if state == _MAYBE_AT_START:
+                    return None
+                if state == _AT_START:
+                    token = {'\\b': r'(?=\w)', '\\B': r'(?!\w)', '\\A': ''}[token]
+                out.append(token)
+                continue
+            out.append(token)
+            if token[1:].isdigit():
+                # a back reference may match nothing
+                before, state = state, _join_states(state, _PAST_START)
+            else:
+                before, state = state, _PAST_START
+        elif c == '^':
+            if state == _MAYBE_AT_START:
+                return None
+            if state == _PAST_START:
+                out.append(c)
+            i += 1
+        elif c == '(':
+            if source.startswith('(?<', i):
+                # look behind
+                return None
+            j = i + 1
+            kind = 'group'
+            if source.startswith('(?#', i):
+                j = source.index(')', i) + 1
+                out.append(source[i:j])
+                i = j
+                continue
+            elif source.startswith('(?P=', i):
+                j = source.index(')', i) + 1
+                out.append(source[i:j])
+                before, state = state, _join_states(state, _PAST_START)
+                i = j
+                continue
+            elif source.startswith('(?(', i):
+                j = source.index(')', i) + 1
+                kind = 'condition'
+            elif source.startswith('(?P<', i):
+                j = source.index('>', i) + 1
+            elif source.startswith('(?=', i) or source.startswith('(?!', i):
+                j = i + 3
+                kind = 'lookahead'
+            elif source.startswith('(?:', i):
+                j = i + 3
+            elif source.startswith('(?', i):
+                # inline flags and other extensions
+                return None
+            out.append(source[i:j])
+            groups.append([state, None, kind])
+            i = j
+        elif c == '|':
+            out.append(c)
+            if groups:
+                group = groups[-1]
+                group[1] = state if group[1] is None else _join_states(group[1], state)
+                state = group[0]
+            else:
+                # top level alternatives all start at the match position
+                state = _AT_START
+            i += 1
+        elif c == ')':
+            out.append(c)
+            start, end, kind = groups.pop()
+            end = state if end is None else _join_states(end, state)
+            if kind == 'lookahead':
+                end = start
+            elif kind == 'condition':
+                # the missing no branch matches nothing
+                end = _join_states(start, end)
+            before, state = start, end
+            i += 1
+        elif c in '*?+' and after_quantifier:
+            # lazy or possessive quantifier
+            out.append(c)
+            i += 1
+        elif c in '*?':
+            out.append(c)
+            state = _join_states(before, state)
+            quantified = True
+            i += 1
+        elif c == '+':
+            out.append(c)
+            quantified = True
+            i += 1
+        elif c == '{':
+            quantifier = _quantifier_pattern.match(source, i)
+            if quantifier and (quantifier.group(1) or quantifier.group(2)):
+                if quantifier.group(1) in ('', '0'):
+                    state = _join_states(before, state)
+                out.append(quantifier.group(0))
+                quantified = True
+                i = quantifier.end()
+            else:
+                out.append(c)
+                before, state = state, _PAST_START
+                i += 1
+        else:
+            # literals, '.' and '$'
+            out.append(c)
+            if c != '$':
+                before, state = state, _PAST_START
+            i += 1
+
+    if groups:
+        return None
+    return ''.join(out)
+
+
 def escape(text, quote=False, smart_amp=True):
     """Replace special characters "&", "<" and ">" to HTML-safe sequences.
 
@@ -192,6 +501,9 @@ class BlockLexer(object):
         'list_block', 'block_html', 'table', 'paragraph', 'text'
     )
 
+    # match the rules in place instead of slicing off every match
+    scan_positions = True
+
     def __init__(self, rules=None, **kwargs):
         self.tokens = []
         self.def_links = {}
@@ -204,6 +516,7 @@ class BlockLexer(object):
         self._max_recursive_depth = kwargs.get('max_recursive_depth', 6)
         self._list_depth = 0
         self._blockquote_depth = 0
+        self._scanners = {}
         self.default_rules = self.default_rules[:]
 
     def __call__(self, text, rules=None):
@@ -215,6 +528,9 @@ class BlockLexer(object):
         if not rules:
             rules = self.default_rules
 
+        if self.scan_positions:
+            return self._parse_positions(text, rules)
+
         def manipulate(text):
             for key in rules:
                 rule = getattr(self.rules, key)
@@ -234,6 +550,21 @@ class BlockLexer(object):
                 raise RuntimeError('Infinite loop at: %s' % text)
         return self.tokens
 
+    def _parse_positions(self, text, rules):
+        scanners = _scanners(self, rules, 'parse_')
+        pos = 0
+        end = len(text)
+        while pos < end:
+            for pattern, parse in scanners:
+                m = pattern.match(text, pos)
+                if m:
+                    parse(self, m)
+                    pos += len(m.group(0))
+                    break
+            else:  # pragma: no cover
+                raise RuntimeError('Infinite loop at: %s' % text[pos:])
+        return self.tokens
+
     def parse_newline(self, m):
         length = len(m.group(0))
         if length > 1:
@@ -533,6 +864,11 @@ class InlineLexer(object):
         'linebreak', 'strikethrough', 'text',
     ]
 
+    # match the rules in place instead of slicing off every match
+    scan_positions = True
+    # match all rules with one combined pattern when scanning positions
+    combine_rules = False
+
     def __init__(self, renderer, rules=None, **kwargs):
         self.renderer = renderer
         self.links = {}
@@ -551,6 +887,7 @@ class InlineLexer(object):
         self._in_link = False
         self._in_footnote = False
         self._parse_inline_html = kwargs.get('parse_inline_html')
+        self._scanners = {}
         self.default_rules = self.default_rules[:]
         self.inline_html_rules = self.inline_html_rules[:]
 
@@ -572,6 +909,9 @@ class InlineLexer(object):
 
         output = self.renderer.placeholder()
 
+        if self.scan_positions:
+            return self._output_positions(text, rules, output)
+
         def manipulate(text):
             for key in rules:
                 pattern = getattr(self.rules, key)
@@ -596,6 +936,50 @@ class InlineLexer(object):
 
         return output
 
+    def _output_positions(self, text, rules, output):
+        scanners = _scanners(self, rules, 'output_')
+        combined = None
+        if self.combine_rules:
+            combined = _combined_scanner(self, rules)
+        parts = []
+        pos = 0
+        end = len(text)
+        while pos < end:
+            first = 0
+            if combined is not None:
+                pattern, alternatives = combined
+                match = pattern.match(text, pos)
+                if match:
+                    offset = match.lastindex
+                    index, size = alternatives[offset]
+                    m = _RuleMatch(match, offset, size)
+                    self.line_match = m
+                    out = scanners[index][1](self, m)
+                    if out is not None:
+                        parts.append(out)
+                        pos = match.end()
+                        continue
+                # the rules after a declining one are tried in turn
+                first = index + 1 if match else len(scanners)
+            for pattern, render in scanners[first:] if first else scanners:
+                m = pattern.match(text, pos)
+                if not m:
+                    continue
+                self.line_match = m
+                out = render(self, m)
+                if out is not None:
+                    parts.append(out)
+                    pos += len(m.group(0))
+                    break
+            else:  # pragma: no cover
+                raise RuntimeError('Infinite loop at: %s' % text[pos:])
+
+        if isinstance(output, str):
+            return output + ''.join(parts)
+        for out in parts:
+            output += out
+        return output
+
     def output_escape(self, m):
         text = m.group(1)
         return self.renderer.escape(text)
@@ -1052,6 +1436,11 @@ class Markdown(object):
         self.inline.setup(self.block.def_links, self.block.def_footnotes)
 
         out = self.renderer.placeholder()
+        if isinstance(out, str):
+            parts = []
+            while self.pop():
+                parts.append(self.tok())
+            return out + ''.join(parts)
         while self.pop():
             out += self.tok()
         return out
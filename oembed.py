@@ -1,19 +1,99 @@
 import json, urllib.request, urllib.parse, urllib.error
-import sys
-
-def loadEmbedCode(url):
-    serviceUrl = "http://noembed.com/embed"
-    getdata = urllib.parse.urlencode({'url': url})
-    fullUrl = serviceUrl + "?" + getdata
-    try:
-        response = urllib.request.urlopen(fullUrl)
-    except urllib.error.URLError as e:
-        print("oembed URLError", fullUrl, file=sys.stderr)
-        return None
-    except urllib.error.HTTPError as e:
-        print("oembed HTTPError", fullUrl, file=sys.stderr)
-        return None
-    data = json.load(response)
-    if "error" in data:
-        return None
-    return data.get("html")
+import concurrent.futures, sqlite3, sys, threading, time
+
+DefaultEndpoint = "http://noembed.com/embed"
+
+class EmbedCache(object):
+    # embed codes by url, None for urls the endpoint has no embed code for
+    def __init__(self, filename, ttl=30*24*60*60, negativeTtl=24*60*60):
+        self.ttl = ttl
+        self.negativeTtl = negativeTtl
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS embeds ("
+                        "url TEXT PRIMARY KEY, html TEXT, created REAL NOT NULL)")
+        self.db.commit()
+
+    def get(self, urls):
+        # returns the fresh entries of urls as a dict, html is None for negative results
+        now = time.time()
+        found = {}
+        with self.lock:
+            for url in urls:
+                row = self.db.execute("SELECT html, created FROM embeds WHERE url=?", (url,)).fetchone()
+                if row is None:
+                    continue
+                html, created = row
+                ttl = self.ttl if html is not None else self.negativeTtl
+                if ttl is None or created + ttl >= now:
+                    found[url] = html
+        return found
+
+    def set(self, results):
+        now = time.time()
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO embeds (url, html, created) VALUES (?, ?, ?)",
+                                [(url, html, now) for url, html in results.items()])
+            self.db.commit()
+
+    def invalidate(self, url=None):
+        with self.lock:
+            if url is None:
+                self.db.execute("DELETE FROM embeds")
+            else:
+                self.db.execute("DELETE FROM embeds WHERE url=?", (url,))
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+class EmbedResolver(object):
+    def __init__(self, cache=None, endpoint=DefaultEndpoint, timeout=10.0, maxWorkers=8):
+        self.cache = cache
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.maxWorkers = maxWorkers
+
+    def fetch(self, url):
+        # returns (html, definite), definite is False for failures worth retrying later
+        fullUrl = self.endpoint + "?" + urllib.parse.urlencode({'url': url})
+        try:
+            with urllib.request.urlopen(fullUrl, timeout=self.timeout) as response:
+                data = json.load(response)
+        except urllib.error.HTTPError as e:
+            print("oembed HTTPError", e.code, fullUrl, file=sys.stderr)
+            return None, 400 <= e.code < 500
+        except (urllib.error.URLError, OSError) as e:
+            print("oembed URLError", fullUrl, e, file=sys.stderr)
+            return None, False
+        except ValueError:
+            print("oembed invalid response", fullUrl, file=sys.stderr)
+            return None, False
+        if not isinstance(data, dict) or "error" in data:
+            return None, True
+        return data.get("html"), True
+
+    def resolve(self, url):
+        return self.resolveMany([url]).get(url)
+
+    def resolveMany(self, urls):
+        # resolves the urls concurrently, returns a dict url -> embed code or None
+        urls = list(dict.fromkeys(urls))
+        results = self.cache.get(urls) if self.cache is not None else {}
+        missing = [url for url in urls if not url in results]
+        if not missing:
+            return results
+
+        definite = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(self.maxWorkers, len(missing)))) as executor:
+            for url, (html, isDefinite) in zip(missing, executor.map(self.fetch, missing)):
+                results[url] = html
+                if isDefinite:
+                    definite[url] = html
+        if self.cache is not None and definite:
+            self.cache.set(definite)
+        return results
+
+def loadEmbedCode(url, timeout=10.0):
+    return EmbedResolver(timeout=timeout).resolve(url)
@@ -0,0 +1,60 @@
+import os, random, sys, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import memrise_markdown
+
+mistune = memrise_markdown.mistune
+
+# the lexer switches and their values in each mode, slicing is the original mistune behaviour
+Settings = [(mistune.BlockLexer, 'scan_positions'), (mistune.InlineLexer, 'scan_positions'), (memrise_markdown.MemriseInlineLexer, 'combine_rules')]
+Modes = [('slicing', (False, False, False)), ('positions', (True, True, False)), ('combined', (True, True, True))]
+
+Options = [{}, {'hard_wrap': True}, {'parse_block_html': True, 'parse_inline_html': True},
+           {'hard_wrap': True, 'parse_block_html': True, 'parse_inline_html': True}]
+
+Snippets = ["der Hund", "la casa", "el gato", "**bold** word", "*emph*", "_under_", "`code`", "a <b>tag</b>",
+            "img: http://x.com/a.png", "img:http://x.com/b.jpg", "embed: https://youtube.com/watch?v=1",
+            "![alt](http://x.com/c.png \"t\")", "[link](http://y.com)", "http://auto.com/x", "<http://z.com>",
+            "line  \nbreak", "~~del~~", "# Head", "- a\n- b\n\n1. x\n2. y", "> quote\n> more", "    code block",
+            "```\nfence\n```", "a|b\n-|-\n1|2", "[^1] note\n\n[^1]: foot", "[ref][r]\n\n[r]: http://r.com", "\\*esc\\*",
+            "&amp; & < >", "ünïcödé 日本語", "***", "Setext\n===", "<div>block</div>\n\ntext", "a_b_c", "x\ty",
+            "<span>_a_ b</span>", "<div>**a**\n\n_b_</div>"]
+
+# emphasis after word characters and anchors around matches
+EdgeCases = ["a_b_ c", "x_y_", "foo_bar_ baz", "**a**_b_ c", "a*b* c", "1_2_", "é_x_ y", "<span>_a_ b</span>",
+             "[a_b_ c](http://x)", "- a_b_ c\n- d", "> q_r_ s", "text\\_x_ y", "~~a~~_b_ c"]
+
+Alphabet = list("ab _*`~\\<>[]()!#-+.:|\n  \t^&") + ["http://", "img:", "embed: http://e.com/x", "__", "**", "  \n", "\n\n",
+                                                    "1. ", "[x]: http://q", "<div>", "</div>", "<em>", "</em>"]
+
+def corpus(seed=1):
+    r = random.Random(seed)
+    texts = list(Snippets) + list(EdgeCases)
+    texts += [" ".join(r.choice(Snippets) for _ in range(r.randint(1, 4))) for _ in range(500)]
+    texts += ["".join(r.choice(Alphabet) for _ in range(r.randint(1, 40))) for _ in range(3000)]
+    texts.append("\n\n".join(r.choice(Snippets) for _ in range(500)))
+    return texts
+
+def render(texts, values, options):
+    saved = [getattr(cls, attr) for cls, attr in Settings]
+    for (cls, attr), value in zip(Settings, values):
+        setattr(cls, attr, value)
+    try:
+        converter = memrise_markdown.Converter(cacheSize=0, **options)
+        return [converter.convert(text) for text in texts]
+    finally:
+        for (cls, attr), value in zip(Settings, saved):
+            setattr(cls, attr, value)
+
+class MarkdownModesTest(unittest.TestCase):
+    def test_modes_render_alike(self):
+        texts = corpus()
+        for options in Options:
+            outputs = {name: render(texts, values, options) for name, values in Modes}
+            for name, _ in Modes[1:]:
+                with self.subTest(mode=name, options=options):
+                    self.assertEqual(outputs[name], outputs['slicing'])
+
+if __name__ == '__main__':
+    unittest.main()